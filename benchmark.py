@@ -0,0 +1,106 @@
+import timeit
+
+import re
+
+from data_ingestor import parse_timestamp, parse_timestamps
+from interpreter import Lexer, RegexLexer, Parser, Interpreter, Compiler, Program, RegexSet, token_map, EOF
+
+
+EXPRESSIONS = [
+    '(ATTR * 9/5) + 32',
+    '2*ATTR-3',
+    '(ATTR - 32) * 5 / 9 + ATTR ^ 2 - (ATTR * 3 + 7) / 2',
+    'REGEX(value, "^[A-E]$")',
+]
+BINDINGS = {'ATTR': 21, 'value': 'E'}
+
+
+def report(name, baseline, candidate, unit='evals/s'):
+    print(f"{name:<60} {baseline:>14,.0f} {candidate:>14,.0f} {unit:<9} x{candidate / baseline:.1f}")
+
+
+def rate(function, number):
+    seconds = min(timeit.repeat(function, number=number, repeat=5))
+    return number / seconds
+
+
+def bench_compiler(number=20000):
+    """Tree-walking Interpreter against the compiled Python function"""
+    print(f"{'interpreter vs compiler':<60} {'interpreter':>14} {'compiler':>14}")
+    for expression in EXPRESSIONS:
+        tree = Parser(Lexer(expression, token_map)).parse()
+        interpreter = Interpreter()
+        function = Compiler().compile(tree)
+        report(expression,
+               rate(lambda: interpreter.evaluate(tree, BINDINGS), number),
+               rate(lambda: function(BINDINGS), number))
+
+
+def bench_regex_set(number=2000):
+    """One search per pattern against a single combined RegexSet scan"""
+    patterns = ['^ALARM', 'TEMP_[0-9]+', 'fault|error', r'\bOK\b', 'E$', '[#@!]']
+    patterns += ['CODE_{:03d}'.format(code) for code in range(40)]
+    patterns += patterns[:10]
+    compiled = [re.compile(pattern) for pattern in patterns]
+    for combine in (False, True):
+        regex_set = RegexSet(patterns, combine=combine)
+        print(f"{'regex searches vs RegexSet(combine=' + str(combine) + ')':<60} {'search':>14} {'RegexSet':>14}")
+        for text in ('E', 'status OK sensor TEMP_42 reading nominal ' * 25 + 'CODE_007'):
+            report(f'{len(patterns)} patterns, {len(text)} chars',
+                   rate(lambda: [regex.search(text) is not None for regex in compiled], number),
+                   rate(lambda: regex_set.match(text), number))
+
+
+def bench_stack_machine(number=20000):
+    """Tree-walking Interpreter against the iterative stack machine"""
+    print(f"{'interpreter vs stack machine':<60} {'interpreter':>14} {'Program':>14}")
+    for expression in EXPRESSIONS:
+        tree = Parser(Lexer(expression, token_map)).parse()
+        interpreter = Interpreter()
+        program = Program.from_tree(tree)
+        report(expression,
+               rate(lambda: interpreter.evaluate(tree, BINDINGS), number),
+               rate(lambda: program.run(BINDINGS), number))
+
+
+def tokenize(lexer):
+    while lexer.get_next_token().type != EOF:
+        pass
+
+
+def bench_lexer(number=20):
+    """Per-character tokenizer chain against the single-pass RegexLexer"""
+    print(f"{'Lexer vs RegexLexer':<60} {'Lexer':>14} {'RegexLexer':>14}")
+    for repeat in (1, 10, 100):
+        expression = ' + '.join(['(ATTR * 9/5) + 32 - REGEX(value, "^[A-E]$") ^ 2'] * repeat)
+        characters = len(expression)
+        report(f'{characters} chars',
+               rate(lambda: tokenize(Lexer(expression, token_map)), number) * characters,
+               rate(lambda: tokenize(RegexLexer(expression, token_map)), number) * characters,
+               'chars/s')
+
+
+def bench_timestamps(number=20000):
+    """pd.to_datetime, per record and per batch, against parse_timestamp(s)"""
+    import pandas as pd
+
+    print(f"{'timestamp parsing':<60} {'pandas':>14} {'parser':>14}")
+    values = [f"2024-11-{day:02d}T11:{minute:02d}:18Z[UTC]" for day in range(1, 29) for minute in range(60)]
+    value = values[0]
+    report('one record', rate(lambda: pd.to_datetime(value.replace('[UTC]', '').strip()), number // 20),
+           rate(lambda: parse_timestamp(value), number), 'parses/s')
+    batch = [value.replace('[UTC]', '') for value in values]
+    report(f'batch of {len(values)}', rate(lambda: pd.to_datetime(batch), 20) * len(values),
+           rate(lambda: parse_timestamps(values), 20) * len(values), 'parses/s')
+
+
+def main():
+    bench_compiler()
+    bench_stack_machine()
+    bench_lexer()
+    bench_regex_set()
+    bench_timestamps()
+
+
+if __name__ == "__main__":
+    main()
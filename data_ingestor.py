@@ -1,6 +1,30 @@
+import csv
+import ctypes
+import ctypes.util
+import glob
+import marshal
+import mmap
+import os
+import select
+import sys
 import time
-import pandas as pd
 from abc import ABC, abstractmethod
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import islice
+from zlib import crc32
+
+
+def write_atomically(path, data):
+    """Writes `data` next to `path` and renames it over it, so a crash never leaves half a file"""
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
 
 
 class DataReader(ABC):
@@ -9,11 +33,89 @@ class DataReader(ABC):
         pass
 
 
+class PollingFileWatcher:
+    """Wakes a follower every `interval` seconds, works on any platform and filesystem"""
+    def __init__(self, file_path, interval=0.5):
+        self.file_path = file_path
+        self.interval = interval
+
+    def wait(self):
+        time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyFileWatcher:
+    """
+    Blocks until the kernel reports a change in the directory of the file
+    (Linux only). The directory is watched rather than the file so that a
+    rotated file being replaced is noticed too. `interval` bounds each wait.
+    """
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, file_path, interval=0.5):
+        self.file_path = file_path
+        self.interval = interval
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = (self.IN_MODIFY | self.IN_ATTRIB | self.IN_MOVED_FROM | self.IN_MOVED_TO
+                | self.IN_CREATE | self.IN_DELETE)
+        directory = os.path.dirname(os.path.abspath(file_path))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def wait(self):
+        readable, _, _ = select.select([self.fd], [], [], self.interval)
+        if readable:
+            # Drain the queued events, the follower re-checks the file anyway
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def create_file_watcher(file_path, interval=0.5):
+    """inotify where the platform has it, polling otherwise"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyFileWatcher(file_path, interval)
+        except (OSError, AttributeError):
+            pass
+    return PollingFileWatcher(file_path, interval)
+
+
 class CSVDataReader(DataReader):
-    def __init__ (self, file_path):
+    """
+    Reads a CSV file record by record. With `follow=True` it keeps reading
+    lines as they are appended, like tail -F, reopening the file when it is
+    rotated and starting over when it is truncated, until stop() is called.
+    """
+    def __init__ (self, file_path, follow=False, poll_interval=0.5):
         self.file_path = file_path
         self.file = None
         self.header = None
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.inode = None
+        self.stopped = False
 
 
     def open_file(self):
@@ -26,10 +128,16 @@ class CSVDataReader(DataReader):
             self.file.close()
             self.file = None
 
+    def stop(self):
+        self.stopped = True
+
     def read_records(self):
         """
         Reads the file record by record using a generator to avoid re-reading the entire file.
         """
+        if self.follow:
+            yield from self.follow_records()
+            return
         try:
             self.open_file()
             for line in self.file:
@@ -40,33 +148,589 @@ class CSVDataReader(DataReader):
         finally:
             self.close_file()
 
+    def reopen(self):
+        """Opens the file without consuming the header, which may not be written yet"""
+        self.close_file()
+        try:
+            self.file = open(self.file_path, 'r')
+        except FileNotFoundError:
+            return False
+        self.header = None
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        return True
+
+    def changed(self):
+        """'rotated' if the path now names another file, 'truncated' if it shrank, else None"""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            # Moved away and not recreated yet
+            return None
+        if stat.st_ino != self.inode:
+            return 'rotated'
+        if stat.st_size < self.file.tell():
+            return 'truncated'
+        return None
+
+    def follow_records(self):
+        self.stopped = False
+        watcher = create_file_watcher(self.file_path, self.poll_interval)
+        pending = ''
+        try:
+            while not self.stopped:
+                if self.file is None and not self.reopen():
+                    watcher.wait()
+                    continue
+
+                line = self.file.readline()
+                if line:
+                    pending += line
+                    if not pending.endswith('\n'):
+                        # The writer is half way through a line
+                        continue
+                    fields = pending.strip().split(",")
+                    pending = ''
+                    if self.header is None:
+                        self.header = fields
+                    elif fields != self.header and fields != ['']:
+                        yield dict(zip(self.header, fields))
+                    continue
+
+                change = self.changed()
+                if change == 'rotated':
+                    self.close_file()
+                    pending = ''
+                elif change == 'truncated':
+                    # Keep the header, a rewritten file repeats it and is skipped above
+                    self.file.seek(0)
+                    pending = ''
+                else:
+                    watcher.wait()
+        finally:
+            watcher.close()
+            self.close_file()
+
+
+class MmapCSVDataReader(DataReader):
+    """
+    Reads a CSV file through mmap and records how far it got in a small
+    checkpoint file: the byte offset past the last record handed out and,
+    when given, the DataFilter state. On start it resumes from the
+    checkpoint, so a restart costs the same whatever the size of the file.
+
+    A checkpoint is written every `checkpoint_every` records or
+    `checkpoint_interval` seconds, whichever comes first, and at the end of
+    the file. A record counts as done once the consumer asks for the next
+    one; when reading stops early, the records after the last checkpoint
+    are read again on restart (the filter state is rolled back with them),
+    so delivery is at least once. If the
+    file was replaced (other inode) or truncated below the offset, reading
+    starts over from the header, but the filter state is still restored.
+
+    A last line without a trailing newline is read as a record. When the
+    file may be read while a writer is still appending to it, pass
+    complete_lines_only=True so a half-written tail is left for the next run.
+    """
+    CHECKPOINT_VERSION = 1
+
+    def __init__(self, file_path, checkpoint_path=None, data_filter: 'DataFilter' = None,
+                 checkpoint_every=10000, checkpoint_interval=5.0, complete_lines_only=False):
+        self.file_path = file_path
+        self.checkpoint_path = checkpoint_path or f"{file_path}.checkpoint"
+        self.data_filter = data_filter
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.complete_lines_only = complete_lines_only
+        self.header = None
+        self.inode = None
+        self.offset = 0
+
+    def load_checkpoint(self):
+        """Returns the saved offset if it still applies to the file, else None"""
+        try:
+            with open(self.checkpoint_path, 'rb') as file:
+                version, inode, offset, filter_state = marshal.loads(file.read())
+        except FileNotFoundError:
+            return None
+        except (EOFError, ValueError, TypeError) as e:
+            print(f"Error: Ignoring unreadable checkpoint {self.checkpoint_path}: {e}")
+            return None
+        if version != self.CHECKPOINT_VERSION:
+            print(f"Error: Ignoring checkpoint version {version}")
+            return None
+        if self.data_filter is not None and filter_state is not None:
+            self.data_filter.load_state(filter_state)
+        return offset if inode == self.inode else None
+
+    def checkpoint(self):
+        filter_state = self.data_filter.dump_state() if self.data_filter is not None else None
+        write_atomically(self.checkpoint_path,
+                         marshal.dumps((self.CHECKPOINT_VERSION, self.inode, self.offset, filter_state)))
+
+    def read_records(self):
+        try:
+            file = open(self.file_path, 'rb')
+        except FileNotFoundError:
+            print(f"Error: File not found at {self.file_path}")
+            return
+        with file:
+            self.inode = os.fstat(file.fileno()).st_ino
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                header_end = data.find(b'\n')
+                if header_end < 0:
+                    return
+                self.header = data[:header_end].decode().strip().split(",")
+                offset = self.load_checkpoint()
+                if offset is None or not header_end < offset <= size:
+                    offset = header_end + 1
+                self.offset = offset
+                yield from self.read_from(data, offset)
+
+    def read_from(self, data, position):
+        header = self.header
+        pending = 0
+        last_checkpoint = time.monotonic()
+        while True:
+            end = data.find(b'\n', position)
+            if end < 0:
+                if self.complete_lines_only or position >= len(data):
+                    break
+                end = len(data)
+            line = data[position:end].decode().strip()
+            position = min(end + 1, len(data))
+            if line:
+                yield dict(zip(header, line.split(",")))
+            self.offset = position
+            pending += 1
+            if pending >= self.checkpoint_every or time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                self.checkpoint()
+                pending = 0
+                last_checkpoint = time.monotonic()
+        self.checkpoint()
+
+
+class RecordBatch:
+    """
+    A chunk of rows held column-wise as {column: sequence of values}, all of
+    the same length, so consumers work on whole columns instead of a dict
+    per row.
+    """
+    __slots__ = ('columns', 'length')
+
+    def __init__(self, columns, length):
+        self.columns = columns
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def column(self, name):
+        return self.columns[name]
+
+    def take(self, indices):
+        """The rows at `indices`, in that order, as a new batch"""
+        indices = list(indices)
+        return RecordBatch({name: values.take(indices) if hasattr(values, 'take') else [values[i] for i in indices]
+                            for name, values in self.columns.items()},
+                           len(indices))
+
+    def records(self):
+        """Rows as dicts, for consumers that still work record by record"""
+        names = list(self.columns)
+        # NumPy columns are turned into plain Python values first
+        columns = [values.tolist() if hasattr(values, 'tolist') else values for values in self.columns.values()]
+        for row in zip(*columns):
+            yield dict(zip(names, row))
+
+
+def partition_of(asset_id, partitions):
+    """The partition owning an asset, stable across processes and runs"""
+    return crc32(asset_id.strip().encode()) % partitions
+
+
+class CSVBatchReader(DataReader):
+    """
+    Reads a CSV file `chunk_size` rows at a time with the csv module, so
+    quoted fields are handled, and yields each chunk as a RecordBatch.
+    Rows whose field count does not match the header are skipped.
+
+    With `partition=(index, count)` only rows of the assets that partition
+    owns are parsed: other lines are dropped after reading their asset_id,
+    which assumes asset_id itself is never quoted and no field spans lines.
+    """
+    def __init__(self, file_path, chunk_size=10000, partition=None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.partition = partition
+        self.header = None
+        self.skipped = 0
+
+    def owned_lines(self, lines, column):
+        index, count = self.partition
+        owners = {}
+        for line in lines:
+            fields = line.split(',', column + 1)
+            if len(fields) <= column:
+                # Malformed, let a single partition report it
+                if index == 0:
+                    yield line
+                continue
+            asset_id = fields[column]
+            owner = owners.get(asset_id)
+            if owner is None:
+                owner = owners[asset_id] = partition_of(asset_id, count)
+            if owner == index:
+                yield line
+
+    def read_batches(self):
+        try:
+            with open(self.file_path, 'r', newline='') as file:
+                reader = csv.reader(file)
+                self.header = [name.strip() for name in next(reader, [])]
+                width = len(self.header)
+                if self.partition is not None and 'asset_id' in self.header:
+                    reader = csv.reader(self.owned_lines(file, self.header.index('asset_id')))
+                while True:
+                    rows = list(islice(reader, self.chunk_size))
+                    if not rows:
+                        break
+                    valid = rows
+                    if set(map(len, rows)) != {width}:
+                        valid = [row for row in rows if len(row) == width]
+                        self.skipped += len(rows) - len(valid)
+                        print(f"Warning: skipped {len(rows) - len(valid)} malformed rows in {self.file_path}")
+                    if valid:
+                        yield RecordBatch(dict(zip(self.header, zip(*valid))), len(valid))
+        except FileNotFoundError:
+            print(f"Error: File not found at {self.file_path}")
+
+    def read_records(self):
+        for batch in self.read_batches():
+            yield from batch.records()
+
+
+class ArrowDataReader(DataReader):
+    """
+    Base for readers of columnar files through pyarrow (imported on first
+    use). Only `columns` are loaded, and each Arrow record batch becomes a
+    RecordBatch of NumPy columns; numeric columns without nulls are views
+    on the Arrow buffers. Typed timestamp columns are handed out as int64
+    epoch microseconds, which DataFilter uses without string parsing.
+    """
+    columns = ('asset_id', 'attribute_id', 'timestamp', 'value')
+
+    def __init__(self, file_path, columns=None, batch_size=65536):
+        self.file_path = file_path
+        self.columns = tuple(columns) if columns is not None else self.columns
+        self.batch_size = batch_size
+
+    @abstractmethod
+    def arrow_batches(self, pa):
+        pass
+
+    def to_numpy(self, pa, array):
+        if pa.types.is_timestamp(array.type):
+            # Arrow keeps timestamps as UTC integers, only the unit may differ
+            array = array.cast(pa.timestamp('us', tz=array.type.tz), safe=False).view(pa.int64())
+        if array.null_count == 0:
+            return array.to_numpy(zero_copy_only=False)
+        return array.to_pylist()
+
+    def read_batches(self):
+        import pyarrow as pa
+
+        try:
+            for batch in self.arrow_batches(pa):
+                yield RecordBatch({name: self.to_numpy(pa, batch.column(name)) for name in batch.schema.names},
+                                  batch.num_rows)
+        except FileNotFoundError:
+            print(f"Error: File not found at {self.file_path}")
+
+    def read_records(self):
+        for batch in self.read_batches():
+            yield from batch.records()
+
+
+class ParquetDataReader(ArrowDataReader):
+    """Streams a Parquet file row group by row group, reading only the projected columns"""
+    def arrow_batches(self, pa):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(self.file_path)
+        columns = [name for name in self.columns if name in parquet_file.schema_arrow.names]
+        yield from parquet_file.iter_batches(batch_size=self.batch_size, columns=columns)
+
+
+class ArrowIPCDataReader(ArrowDataReader):
+    """Reads an Arrow IPC file or stream through a memory map, so batches are not copied"""
+    def arrow_batches(self, pa):
+        with pa.memory_map(self.file_path, 'r') as source:
+            try:
+                reader = pa.ipc.open_file(source)
+                batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+            except pa.ArrowInvalid:
+                source.seek(0)
+                batches = pa.ipc.open_stream(source)
+            for batch in batches:
+                yield batch.select([name for name in self.columns if name in batch.schema.names])
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_ORDINAL = EPOCH.toordinal()
+MICROSECONDS_PER_DAY = 86400 * 1000000
+# Positions of the digits in 'YYYY-MM-DDTHH:MM:SSZ'
+TIMESTAMP_DIGITS = (0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18)
+
+
+@lru_cache(maxsize=4096)
+def day_offset(day):
+    """Microseconds from the epoch to midnight of a 'YYYY-MM-DD' day"""
+    return (date(int(day[0:4]), int(day[5:7]), int(day[8:10])).toordinal() - EPOCH_ORDINAL) * MICROSECONDS_PER_DAY
+
+
+def parse_iso_timestamp(value):
+    """Slow path for anything that is not 'YYYY-MM-DDTHH:MM:SSZ[UTC]'"""
+    text = value.strip()
+    if text.endswith(']'):
+        # Zone names such as [UTC] or [Europe/Paris] are informative only, the offset decides
+        text = text[:text.rindex('[')]
+    parsed = datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return (parsed - EPOCH) // timedelta(microseconds=1)
+
+
+def parse_timestamp(value):
+    """
+    Parses a feed timestamp such as '2024-11-24T11:44:18Z[UTC]' into integer
+    microseconds since the epoch. Integers are taken to be epoch microseconds
+    already, other ISO 8601 strings go through datetime.fromisoformat.
+    Raises ValueError for anything else, including None from a null column.
+    """
+    if isinstance(value, int):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid timestamp {value!r}")
+    if ((len(value) == 25 and value[20:] == '[UTC]') or len(value) == 20) and value[4] == value[7] == '-' \
+            and value[10] == 'T' and value[13] == value[16] == ':' and value[19] == 'Z' \
+            and all(value[index].isascii() and value[index].isdigit() for index in TIMESTAMP_DIGITS):
+        hours, minutes, seconds = int(value[11:13]), int(value[14:16]), int(value[17:19])
+        # Out of range times go to the slow path, which rejects them
+        if hours <= 23 and minutes <= 59 and seconds <= 59:
+            return day_offset(value[:10]) + (hours * 3600 + minutes * 60 + seconds) * 1000000
+    return parse_iso_timestamp(value)
+
+
+def parse_timestamps(values):
+    """
+    Vectorized parse_timestamp for a batch, returns an int64 NumPy array of
+    epoch microseconds. Rows in the feed format are decoded with array
+    arithmetic on their bytes, the others fall back to parse_timestamp.
+    Integer arrays are epoch microseconds already and are returned as is.
+    """
+    import numpy as np
+
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+        return values.astype(np.int64, copy=False)
+    values = list(values)
+    result = np.zeros(len(values), dtype=np.int64)
+    if not values:
+        return result
+    try:
+        # One byte more than the format, so longer strings are not silently cut to a valid length
+        raw = np.array(values, dtype='S26')
+    except (UnicodeEncodeError, TypeError, ValueError):
+        raw = None
+    if raw is not None:
+        chars = raw.view(np.uint8).reshape(len(values), 26)
+        digits = chars.astype(np.int64) - ord('0')
+        digit_positions = list(TIMESTAMP_DIGITS)
+        fast = (chars[:, 4] == ord('-')) & (chars[:, 7] == ord('-')) & (chars[:, 10] == ord('T'))
+        fast &= (chars[:, 13] == ord(':')) & (chars[:, 16] == ord(':')) & (chars[:, 19] == ord('Z'))
+        fast &= ((digits[:, digit_positions] >= 0) & (digits[:, digit_positions] <= 9)).all(axis=1)
+        fast &= (chars[:, 20] == 0) | (np.all(chars[:, 20:25] == np.frombuffer(b'[UTC]', dtype=np.uint8), axis=1)
+                                       & (chars[:, 25] == 0))
+
+        year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        month = digits[:, 5] * 10 + digits[:, 6]
+        day = digits[:, 8] * 10 + digits[:, 9]
+        leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        month_days = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[np.clip(month, 1, 12) - 1]
+        month_days = month_days + (leap & (month == 2))
+        fast &= (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= month_days)
+        # Days from 1970-01-01 for a proleptic Gregorian date (Howard Hinnant's days_from_civil)
+        y = year - (month <= 2)
+        era = y // 400
+        yoe = y - era * 400
+        doy = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+        doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+        days = era * 146097 + doe - 719468
+        hours = digits[:, 11] * 10 + digits[:, 12]
+        minutes = digits[:, 14] * 10 + digits[:, 15]
+        seconds = digits[:, 17] * 10 + digits[:, 18]
+        fast &= (hours <= 23) & (minutes <= 59) & (seconds <= 59)
+        seconds = hours * 3600 + minutes * 60 + seconds
+        result = np.where(fast, (days * 86400 + seconds) * 1000000, 0)
+    else:
+        fast = np.zeros(len(values), dtype=bool)
+
+    for index in np.flatnonzero(~fast):
+        result[index] = parse_timestamp(values[index])
+    return result
+
 
 class DataFilter:
-    def __init__(self):
+    """
+    Drops records that are not newer than what was already seen, tracked per
+    asset. A record is kept when its timestamp is past the asset's watermark
+    (the latest timestamp kept for it), or no more than `allowed_lateness`
+    seconds behind it.
+
+    Asset ids are interned to slots of one array('q') of epoch microseconds,
+    so the state costs about 8 bytes per asset plus the id, and save()/load()
+    spill it to disk with marshal.
+    """
+    STATE_VERSION = 1
+
+    def __init__(self, allowed_lateness=0):
+        self.allowed_lateness = allowed_lateness
+        self.lateness = int(allowed_lateness * 1000000)
+        self.slots = {}  # asset_id -> index into watermarks
+        self.watermarks = array('q')
         self.last_timestamp = None  # Track last timestamp processed
 
+    def slot(self, asset_id):
+        slot = self.slots.get(asset_id)
+        if slot is None:
+            slot = self.slots[sys.intern(asset_id)] = len(self.watermarks)
+            self.watermarks.append(-2 ** 63)
+        return slot
+
+    def watermark(self, asset_id):
+        """Latest timestamp kept for the asset in epoch microseconds, None if never seen"""
+        slot = self.slots.get(asset_id)
+        return None if slot is None else self.watermarks[slot]
+
     def is_new_records(self, record):
         """
         Checks if the given record is new based on its timestamp.
         """
         try:
-            timestamp_str = record['timestamp'].replace('[UTC]', '').strip()
-            record_timestamp = pd.to_datetime(timestamp_str)
+            record_timestamp = parse_timestamp(record['timestamp'])
         except KeyError:
             print("Error: Record is missing a 'timestamp' field.")
             return False
+        except ValueError:
+            print(f"Error: Invalid timestamp {record['timestamp']!r}.")
+            return False
 
-
-        if self.last_timestamp is None or record_timestamp > self.last_timestamp :
+        asset_id = record.get('asset_id', '')
+        if asset_id is None:
+            print("Error: Record has a null 'asset_id'.")
+            return False
+        if not self.admit(str(asset_id), record_timestamp):
+            return False
+        if self.last_timestamp is None or record_timestamp > self.last_timestamp:
             self.last_timestamp = record_timestamp
-            return  True
+        return True
+
+    def admit(self, asset_id, timestamp):
+        """Moves the asset's watermark forward, returns False if the timestamp is too old"""
+        slot = self.slot(asset_id)
+        watermark = self.watermarks[slot]
+        if timestamp > watermark:
+            self.watermarks[slot] = timestamp
+            return True
+        return bool(self.lateness) and timestamp >= watermark - self.lateness
+
+    def filter_batch(self, batch: RecordBatch):
+        """
+        is_new_records for a whole RecordBatch: timestamps are parsed in one
+        vectorized pass and the batch of kept rows is returned.
+        """
+        try:
+            timestamps = batch.column('timestamp')
+        except KeyError:
+            print("Error: Batch is missing a 'timestamp' column.")
+            return batch.take([])
+        try:
+            parsed = parse_timestamps(timestamps).tolist()
+        except ValueError:
+            parsed = []
+            for value in timestamps:
+                try:
+                    parsed.append(parse_timestamp(value))
+                except ValueError:
+                    print(f"Error: Invalid timestamp {value!r}.")
+                    parsed.append(None)
 
-        return False
+        asset_ids = batch.columns.get('asset_id')
+        if asset_ids is None:
+            asset_ids = [''] * len(batch)
+        elif not isinstance(asset_ids, tuple):
+            # Typed or nullable columns (CSV columns are tuples of str): watermarks
+            # are keyed on text like is_new_records, nulls are dropped below
+            values = asset_ids.tolist() if hasattr(asset_ids, 'tolist') else asset_ids
+            asset_ids = [asset_id if asset_id is None or type(asset_id) is str else str(asset_id)
+                         for asset_id in values]
+        # admit() inlined, this loop is the per-row cost of a batch
+        slots = self.slots
+        watermarks = self.watermarks
+        lateness = self.lateness
+        keep = []
+        for index, asset_id, timestamp in zip(range(len(parsed)), asset_ids, parsed):
+            if timestamp is None:
+                continue
+            if asset_id is None:
+                print("Error: Record has a null 'asset_id'.")
+                continue
+            slot = slots.get(asset_id)
+            if slot is None:
+                slot = self.slot(asset_id)
+            watermark = watermarks[slot]
+            if timestamp > watermark:
+                watermarks[slot] = timestamp
+                keep.append(index)
+            elif lateness and timestamp >= watermark - lateness:
+                keep.append(index)
+        if keep:
+            latest = max(parsed[index] for index in keep)
+            if self.last_timestamp is None or latest > self.last_timestamp:
+                self.last_timestamp = latest
+        return batch if len(keep) == len(batch) else batch.take(keep)
+
+    def dump_state(self):
+        return marshal.dumps((self.STATE_VERSION, list(self.slots), self.watermarks.tobytes()))
+
+    def load_state(self, data):
+        version, asset_ids, watermarks = marshal.loads(data)
+        if version != self.STATE_VERSION:
+            raise Exception(f"Unsupported filter state version {version}")
+        self.slots = {sys.intern(asset_id): slot for slot, asset_id in enumerate(asset_ids)}
+        self.watermarks = array('q')
+        self.watermarks.frombytes(watermarks)
+        self.last_timestamp = max(self.watermarks) if self.watermarks else None
+
+    def save(self, path):
+        write_atomically(path, self.dump_state())
+
+    def load(self, path):
+        """Restores watermarks written by save(), returns False if there are none yet"""
+        try:
+            with open(path, 'rb') as file:
+                self.load_state(file.read())
+        except FileNotFoundError:
+            return False
+        return True
 
 class DataIngestor:
     """
-    Ingests data record by record at a regular interval.
-
+    Ingests data record by record, optionally paced at a regular interval.
+    With interval None or 0 records are yielded as soon as the reader has
+    them, so latency follows data arrival.
     """
     def __init__ (self, data_reader: DataReader, data_filter: DataFilter, interval =5):
         self.data_reader = data_reader
@@ -79,6 +743,71 @@ class DataIngestor:
         for record in self.data_reader.read_records():
             if self.data_filter.is_new_records(record):
                 yield record
-            time.sleep(self.interval)
+                if self.interval:
+                    time.sleep(self.interval)
 
+    def process_batches(self):
+        """Yields the new rows of each batch of a CSVBatchReader as a RecordBatch"""
+        for batch in self.data_reader.read_batches():
+            batch = self.data_filter.filter_batch(batch)
+            if len(batch):
+                yield batch
+                if self.interval:
+                    time.sleep(self.interval)
 
+
+def ingest_partition(file_paths, partition, partitions, handler=None, allowed_lateness=0, chunk_size=10000):
+    """
+    Runs in a PartitionedIngestor worker: reads the partition's rows from
+    every file in order, filters them and hands each RecordBatch to
+    `handler`. Returns counts and the handler results (the batches
+    themselves without a handler).
+    """
+    data_filter = DataFilter(allowed_lateness=allowed_lateness)
+    summary = {'partition': partition, 'rows': 0, 'kept': 0, 'results': []}
+    for file_path in file_paths:
+        reader = CSVBatchReader(file_path, chunk_size=chunk_size, partition=(partition, partitions))
+        for batch in reader.read_batches():
+            summary['rows'] += len(batch)
+            batch = data_filter.filter_batch(batch)
+            if not len(batch):
+                continue
+            summary['kept'] += len(batch)
+            summary['results'].append(handler(batch) if handler is not None else batch)
+    return summary
+
+
+class PartitionedIngestor:
+    """
+    Ingests a directory or glob of CSV files over a process pool. Each of
+    the `workers` processes owns the asset_ids hashing to its partition and
+    reads them from every file in name order with its own DataFilter, so the
+    per-asset order and filtering are the same as a single DataIngestor.
+
+    `handler` is called in the worker with each RecordBatch of new rows and
+    must be picklable (a module-level function).
+    """
+    def __init__(self, paths, workers=None, handler=None, allowed_lateness=0, chunk_size=10000):
+        self.paths = paths
+        self.workers = workers or os.cpu_count() or 1
+        self.handler = handler
+        self.allowed_lateness = allowed_lateness
+        self.chunk_size = chunk_size
+
+    def files(self):
+        if os.path.isdir(self.paths):
+            return sorted(glob.glob(os.path.join(self.paths, '*.csv')))
+        return sorted(glob.glob(self.paths))
+
+    def process(self):
+        """Yields each partition's summary as its worker finishes"""
+        files = self.files()
+        if not files:
+            print(f"Error: No CSV files found at {self.paths}")
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(ingest_partition, files, partition, self.workers, self.handler,
+                                   self.allowed_lateness, self.chunk_size)
+                       for partition in range(self.workers)]
+            for future in as_completed(futures):
+                yield future.result()
@@ -2,6 +2,11 @@ from abc import ABC, abstractmethod
 import yaml
 import sqlite3
 import os
+import pathlib
+import threading
+import time
+
+from interpreter import FORMAT_VERSION
 
 # Interfaces
 class ConfigReader(ABC):
@@ -14,44 +19,237 @@ class EquationReaderInterface(ABC):
     def get_equation(self) :
         pass
 
+    def get_equations(self):
+        """
+        Every equation that applies, for sources that can hold several, as
+        (kpi_id, expression) pairs; kpi_id is None for sources without ids
+        """
+        equation = self.get_equation()
+        return [(None, equation)] if equation else []
+
 class VariableProcessorInterface(ABC):
     @abstractmethod
     def process(self, equation, record):
         pass
 
+    def bind(self, record):
+        """Variable bindings the processed equation is evaluated against"""
+        return {}
+
+    def bind_columns(self, columns):
+        """bind() for a whole batch given as {field: column}, only for processors that keep the equation text"""
+        raise Exception(f"{type(self).__name__} cannot bind a batch of records")
+
 
 
 # Implementations
 class FileConfigReader(ConfigReader):
+    """
+    Reads the YAML config, re-parsing it only when the file's mtime or size
+    changed since the last read.
+    """
     def __init__(self, config_file):
         self.config_file = config_file
+        self.cached = None  # (mtime_ns, size), config
 
     def read_config(self):
         try:
+            stat = os.stat(self.config_file)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            cached = self.cached
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+
             with open(self.config_file, 'r') as file:
-                return yaml.safe_load(file)
+                config = yaml.safe_load(file)
+            self.cached = (signature, config)
+            return config
 
         except FileNotFoundError:
             print(f"Error: Config file '{self.config_file}' not found.")
 
 class EquationConfigReader(EquationReaderInterface):
-    def __init__(self, config_reader: ConfigReader):
+    """
+    Serves the equation from the config together with its compiled form
+    (when an ExpressionCache is given). Both are swapped in as one snapshot,
+    and a new equation that fails to compile leaves the previous one in
+    place, as does a config that cannot be read (e.g. briefly missing while
+    an editor rewrites it). While a ConfigWatcher runs, lookups return the
+    snapshot without touching the file at all.
+
+    Callers needing both the equation and its compiled form take them from
+    one current() snapshot: separate get_equation() and get_compiled()
+    calls may each reload and see different versions of the file.
+    """
+    def __init__(self, config_reader: ConfigReader, expression_cache=None):
         self.config_reader = config_reader
+        self.expression_cache = expression_cache
         self.variable_replacer = None
+        self.snapshot = None  # equation, compiled
+        self.rejected = None
+        self.watched = False
 
-    def get_equation(self):
+    def reload(self):
         config = self.config_reader.read_config()
-        equation = config['equation']
-        return equation
+        equation = config.get('equation') if isinstance(config, dict) else None
+        snapshot = self.snapshot
+        if equation is None and snapshot is not None:
+            # Unreadable or incomplete config, keep serving the last good one
+            return snapshot
+        if snapshot is not None and (snapshot[0] == equation or self.rejected == equation):
+            return snapshot
+        try:
+            compiled = self.expression_cache.get(equation) if self.expression_cache is not None and equation else None
+        except Exception as e:
+            print(f"Error compiling equation '{equation}': {str(e)}")
+            if snapshot is not None:
+                self.rejected = equation
+                return snapshot
+            raise
+        self.snapshot = (equation, compiled)
+        self.rejected = None
+        return self.snapshot
+
+    def current(self):
+        """The (equation, compiled) pair of one version of the config"""
+        snapshot = self.snapshot
+        if self.watched and snapshot is not None:
+            return snapshot
+        return self.reload()
+
+    def get_equation(self):
+        return self.current()[0]
+
+    def get_compiled(self):
+        return self.current()[1]
+
+
+class ConfigWatcher:
+    """
+    Background thread polling the config file every `interval` seconds and
+    swapping a changed equation into an EquationConfigReader.
+    """
+    def __init__(self, equation_reader: EquationConfigReader, interval=1.0):
+        self.equation_reader = equation_reader
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
 
+    def start(self):
+        self.equation_reader.reload()
+        self.equation_reader.watched = True
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='config-watcher', daemon=True)
+        self.thread.start()
 
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.equation_reader.reload()
+            except Exception as e:
+                print(f"Error reloading config: {str(e)}")
 
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.equation_reader.watched = False
+
+
+class SQLiteConnectionProvider:
+    """
+    Long-lived read-only connections to the KPI database, one per thread.
+
+    Connections are opened with a mode=ro URI, keep a statement cache so
+    repeated queries are not re-prepared, and are tuned with mmap_size and
+    cache_size. enable_wal() switches the database to WAL so writes from the
+    Django API do not block the pipeline's reads.
+    """
+    def __init__(self, db_path, mmap_size=256 * 1024 * 1024, cache_size=-16384,
+                 cached_statements=128, busy_timeout=5000):
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def uri(self):
+        return pathlib.Path(self.db_path).resolve().as_uri() + '?mode=ro'
+
+    def enable_wal(self):
+        """Persistently switches the database to WAL, needs write access once"""
+        connection = None
+        try:
+            connection = sqlite3.connect(self.db_path)
+            return connection.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return None
+        finally:
+            if connection:
+                connection.close()
+
+    def open(self):
+        """A new tuned connection, not tied to a thread but still closed by close()"""
+        if not os.path.exists(self.db_path):
+            raise FileNotFoundError(f"Database file not found at: {self.db_path}")
+        connection = sqlite3.connect(self.uri(), uri=True, check_same_thread=False,
+                                     cached_statements=self.cached_statements)
+        connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        connection.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        with self.lock:
+            self.connections.append(connection)
+        return connection
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self.open()
+        return connection
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        self.local = threading.local()
+
+
+KPI_QUERY = """
+    SELECT ak.asset_id, k.id, k.expression
+    FROM kpi_monitor_assetkpi ak
+    JOIN kpi_monitor_kpi k ON ak.kpi_id = k.id
+"""
+
+
+def fetch_equations(connection, asset_ids, chunk_size=500):
+    """
+    Resolves every KPI expression of the given assets, one query per chunk
+    of asset_ids (kept below SQLite's bound parameter limit).
+    Returns {asset_id: [(kpi_id, expression), ...]} in AssetKPI order.
+    """
+    asset_ids = list(dict.fromkeys(asset_ids))
+    equations = {}
+    for start in range(0, len(asset_ids), chunk_size):
+        chunk = asset_ids[start:start + chunk_size]
+        cursor = connection.execute(
+            KPI_QUERY + " WHERE ak.asset_id IN ({}) ORDER BY ak.id".format(', '.join('?' * len(chunk))),
+            chunk)
+        for asset_id, kpi_id, expression in cursor:
+            equations.setdefault(asset_id, []).append((kpi_id, expression))
+    return equations
 
 
 class EquationReader(EquationReaderInterface):
-    def __init__(self, asset_id, db_path):
+    def __init__(self, asset_id, db_path, connection_provider: SQLiteConnectionProvider = None):
         self.asset_id = asset_id
         self.db_path = db_path
+        self.connection_provider = connection_provider
 
     def get_equation(self):
         """
@@ -59,30 +257,311 @@ class EquationReader(EquationReaderInterface):
         """
         connection = None
         try:
+            if self.connection_provider:
+                return self.fetch_equation(self.connection_provider.connection())
+
             if not os.path.exists(self.db_path):
                 raise FileNotFoundError(f"Database file not found at: {self.db_path}")
 
             connection = sqlite3.connect(self.db_path)
-            cursor = connection.cursor()
+            return self.fetch_equation(connection)
 
-            cursor.execute("""
-                SELECT k.expression 
-                FROM kpi_monitor_assetkpi ak
-                JOIN kpi_monitor_kpi k ON ak.kpi_id = k.id
-                WHERE ak.asset_id = ?
-            """, (self.asset_id,))
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return None
+
+        finally:
+            if connection:
+                connection.close()
+
+    def fetch_equation(self, connection):
+        cursor = connection.cursor()
 
-            result = cursor.fetchone()
-            return result[0] if result else None
+        cursor.execute("""
+            SELECT k.expression 
+            FROM kpi_monitor_assetkpi ak
+            JOIN kpi_monitor_kpi k ON ak.kpi_id = k.id
+            WHERE ak.asset_id = ?
+        """, (self.asset_id,))
+
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    def get_equations(self):
+        """
+        Fetch every equation linked to asset_id, not only the first one
+        """
+        reader = BulkEquationReader(self.db_path, connection_provider=self.connection_provider)
+        return reader.get_equations([self.asset_id]).get(self.asset_id, [])
+
+
+class BulkEquationReader:
+    """Resolves the KPIs of a whole batch of assets in one round trip"""
+    def __init__(self, db_path, chunk_size=500, connection_provider: SQLiteConnectionProvider = None):
+        self.db_path = db_path
+        self.chunk_size = chunk_size
+        self.connection_provider = connection_provider
+
+    def get_equations(self, asset_ids):
+        connection = None
+        try:
+            if self.connection_provider:
+                return fetch_equations(self.connection_provider.connection(), asset_ids, self.chunk_size)
+
+            if not os.path.exists(self.db_path):
+                raise FileNotFoundError(f"Database file not found at: {self.db_path}")
+
+            connection = sqlite3.connect(self.db_path)
+            return fetch_equations(connection, asset_ids, self.chunk_size)
 
         except sqlite3.Error as e:
             print(f"Database error: {e}")
+            return {}
+
+        finally:
+            if connection:
+                connection.close()
+
+
+class KPIChangeFeed:
+    """
+    Reads the kpi_monitor_kpichange log the Django app appends to on every
+    KPI/AssetKPI save or delete. Rows are read past a cursor (the change id),
+    so each worker only sees what changed since its last poll.
+    """
+    def __init__(self, max_changes=1000):
+        self.max_changes = max_changes
+        self.cursor = None
+
+    def start(self, connection):
+        """Places the cursor at the end of the log, returns False if there is no log table"""
+        try:
+            self.cursor = connection.execute("SELECT COALESCE(MAX(id), 0) FROM kpi_monitor_kpichange").fetchone()[0]
+            return True
+        except sqlite3.OperationalError:
+            self.cursor = None
+            return False
+
+    def poll(self, connection):
+        """
+        Returns the asset_ids touched since the last poll with the id to
+        advance() to once they are applied, or None when the changes cannot
+        be applied incrementally (no log yet, or too many rows). The cursor
+        itself does not move, so changes whose reload fails are polled again.
+        """
+        if self.cursor is None:
+            return None
+        rows = connection.execute(
+            "SELECT id, asset_id, kpi_id FROM kpi_monitor_kpichange WHERE id > ? ORDER BY id LIMIT ?",
+            (self.cursor, self.max_changes + 1)).fetchall()
+        if len(rows) > self.max_changes:
             return None
+        last_id = self.cursor
+        asset_ids = set()
+        kpi_ids = set()
+        for change_id, asset_id, kpi_id in rows:
+            last_id = change_id
+            if asset_id is not None:
+                asset_ids.add(asset_id)
+            elif kpi_id is not None:
+                kpi_ids.add(kpi_id)
+        if kpi_ids:
+            # An edited KPI expression affects every asset it is linked to
+            ids = list(kpi_ids)
+            cursor = connection.execute(
+                "SELECT asset_id FROM kpi_monitor_assetkpi WHERE kpi_id IN ({})".format(', '.join('?' * len(ids))),
+                ids)
+            asset_ids.update(asset_id for asset_id, in cursor)
+        return asset_ids, last_id
+
+    def advance(self, last_id):
+        self.cursor = last_id
+
+
+class KPIRegistry:
+    """
+    In-memory asset_id -> (kpi_id, expression) mapping, loaded from the KPI
+    database with a single query so lookups are dict hits.
+
+    Lookups call refresh(), which at most every `refresh_interval` seconds
+    reads PRAGMA data_version and reloads the mapping only when another
+    connection (e.g. the Django app) has committed since the last load.
+    data_version is only comparable on one connection, so the registry keeps
+    its own (opened by `connection_provider` when given) for every read.
+
+    When the database has a KPI change log, only the assets it names are
+    re-read. `on_change(asset_ids, stale_expressions)` is then called with the
+    expressions no longer used by those assets, e.g. to evict them from an
+    ExpressionCache.
+    """
+    def __init__(self, db_path, refresh_interval=1.0, connection_provider: SQLiteConnectionProvider = None,
+                 change_feed: KPIChangeFeed = None, on_change=None):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.connection_provider = connection_provider
+        self.connection = None
+        self.data_version = None
+        self.last_check = None
+        self.expressions = {}
+        self.change_feed = change_feed if change_feed is not None else KPIChangeFeed()
+        self.on_change = on_change
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.connection is None:
+            if self.connection_provider:
+                self.connection = self.connection_provider.open()
+            else:
+                if not os.path.exists(self.db_path):
+                    raise FileNotFoundError(f"Database file not found at: {self.db_path}")
+                self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self.connection
+
+    def load(self):
+        connection = self.connect()
+        # Place the cursor first so changes committed during the load are replayed
+        self.change_feed.start(connection)
+        cursor = connection.execute(KPI_QUERY + " ORDER BY ak.id")
+        expressions = {}
+        for asset_id, kpi_id, expression in cursor:
+            expressions.setdefault(asset_id, []).append((kpi_id, expression))
+        stale = {e for values in self.expressions.values() for _, e in values}
+        stale.difference_update(e for values in expressions.values() for _, e in values)
+        # Swap the whole mapping so readers never see a partial load
+        previous, self.expressions = self.expressions, expressions
+        if previous and self.on_change:
+            self.on_change(set(previous) | set(expressions), stale)
 
+    def apply_changes(self):
+        """Re-reads only the assets named in the change log, returns False if a full load is needed"""
+        connection = self.connect()
+        polled = self.change_feed.poll(connection)
+        if polled is None:
+            return False
+        asset_ids, last_id = polled
+        if not asset_ids:
+            self.change_feed.advance(last_id)
+            return True
+        fetched = fetch_equations(connection, asset_ids)
+        expressions = dict(self.expressions)
+        stale = set()
+        for asset_id in asset_ids:
+            old = expressions.pop(asset_id, [])
+            new = fetched.get(asset_id)
+            if new:
+                expressions[asset_id] = new
+            stale.update(e for _, e in old)
+        # An expression moved between the changed assets is still in use
+        stale.difference_update(e for asset_id in asset_ids for _, e in expressions.get(asset_id, []))
+        self.expressions = expressions
+        self.change_feed.advance(last_id)
+        if self.on_change:
+            self.on_change(asset_ids, stale)
+        return True
+
+    def refresh(self, force=False):
+        """Reloads the mapping if the database changed, returns True if it did"""
+        now = time.monotonic()
+        if not force and self.last_check is not None and now - self.last_check < self.refresh_interval:
+            return False
+        with self.lock:
+            self.last_check = now
+            try:
+                version = self.connect().execute("PRAGMA data_version").fetchone()[0]
+                if not force and version == self.data_version:
+                    return False
+                if force or self.data_version is None or not self.apply_changes():
+                    self.load()
+                self.data_version = version
+                return True
+            except (sqlite3.Error, FileNotFoundError) as e:
+                print(f"Database error: {e}")
+                return False
+
+    def get_equation(self, asset_id):
+        self.refresh()
+        expressions = self.expressions.get(asset_id)
+        return expressions[0][1] if expressions else None
+
+    def get_equations(self, asset_ids):
+        """Every KPI of each asset in a batch, as {asset_id: [(kpi_id, expression), ...]}"""
+        self.refresh()
+        expressions = self.expressions
+        return {asset_id: expressions[asset_id] for asset_id in asset_ids if asset_id in expressions}
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+
+class RegistryEquationReader(EquationReaderInterface):
+    """EquationReader counterpart answering from a shared KPIRegistry"""
+    def __init__(self, registry: KPIRegistry, asset_id):
+        self.registry = registry
+        self.asset_id = asset_id
+
+    def get_equation(self):
+        return self.registry.get_equation(self.asset_id)
+
+    def get_equations(self):
+        return self.registry.get_equations([self.asset_id]).get(self.asset_id, [])
+
+
+class CompiledExpressionStore:
+    """
+    Keeps the serialized compiled form of KPI expressions (interpreter.dumps)
+    in a small SQLite file, keyed on the expression text, so a starting
+    worker can preload its ExpressionCache without lexing or parsing.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def connect(self):
+        connection = sqlite3.connect(self.db_path)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS compiled_expressions (
+                expression TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                compiled BLOB NOT NULL
+            )
+        """)
+        return connection
+
+    def load(self):
+        """Returns {expression: compiled} for entries in the current format"""
+        connection = None
+        try:
+            connection = self.connect()
+            cursor = connection.execute(
+                "SELECT expression, compiled FROM compiled_expressions WHERE version = ?",
+                (FORMAT_VERSION,))
+            return dict(cursor.fetchall())
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return {}
         finally:
             if connection:
                 connection.close()
 
+    def save(self, compiled_expressions):
+        connection = None
+        try:
+            connection = self.connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO compiled_expressions (expression, version, compiled) VALUES (?, ?, ?)",
+                    ((expression, FORMAT_VERSION, compiled)
+                     for expression, compiled in compiled_expressions.items()))
+            return True
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return False
+        finally:
+            if connection:
+                connection.close()
+
+
 class VariableReplacer(VariableProcessorInterface):
 
         """
@@ -98,6 +577,69 @@ class VariableReplacer(VariableProcessorInterface):
 
 
 
+class NumericText:
+    """
+    A number read from text that str() would not reproduce, e.g. '007' or
+    '1e3'. Arithmetic gives plain numbers, but str() and so REGEX() still
+    see the original text.
+    """
+    def __str__(self):
+        return self.text
+
+
+class TextInt(NumericText, int):
+    pass
+
+
+class TextFloat(NumericText, float):
+    pass
+
+
+def coerce_value(value):
+    """Convert numeric strings coming from the input feed into numbers"""
+    if not isinstance(value, str):
+        return value
+    for number_type, text_type in ((int, TextInt), (float, TextFloat)):
+        try:
+            number = number_type(value)
+        except ValueError:
+            continue
+        if str(number) != value:
+            number = text_type(value)
+            number.text = value
+        return number
+    return value
+
+
+class VariableBinder(VariableProcessorInterface):
+    """
+    Keep the equation text unchanged and expose the record fields as
+    variables, so one parsed expression serves every record.
+    """
+    aliases = {'ATTR': 'attribute_id'}
+
+    def process(self, equation, record):
+        return equation
+
+    def bind(self, record):
+        bindings = {name: coerce_value(value) for name, value in record.items()}
+        for alias, field in self.aliases.items():
+            if field in record:
+                bindings[alias] = bindings[field]
+        return bindings
+
+    def bind_columns(self, columns):
+        """
+        bind() for a whole batch given as {field: column}. Columns are bound
+        as they are, the batch evaluator converts numeric text itself.
+        """
+        bindings = dict(columns)
+        for alias, field in self.aliases.items():
+            if field in columns:
+                bindings[alias] = columns[field]
+        return bindings
+
+
 # select weather to process from a config or from kpi db
 class EquationProcessor:
     def __init__(self,
@@ -110,3 +652,18 @@ class EquationProcessor:
         equation = self.equation_provider.get_equation()
         return self.variable_processor.process(equation, record)
 
+    def process_equations(self, record):
+        """(kpi_id, processed equation) for every equation of the record's asset"""
+        return [(kpi_id, self.variable_processor.process(equation, record))
+                for kpi_id, equation in self.equation_provider.get_equations()]
+
+    def bind(self, record):
+        return self.variable_processor.bind(record)
+
+    def batch_equations(self):
+        """(kpi_id, equation) pairs to evaluate over whole columns, bound with bind_columns()"""
+        return self.equation_provider.get_equations()
+
+    def bind_columns(self, columns):
+        return self.variable_processor.bind_columns(columns)
+
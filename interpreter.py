@@ -1,10 +1,17 @@
 from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+import marshal
 import re
+import struct
+import sys
+import threading
 
 
 # Token types
-INTEGER, PLUS, MINUS, MUL, DIV, LPAREN, RPAREN, POW, EOF, REGEX, STRING, COMMA = (
-    'INTEGER', 'PLUS', 'MINUS', 'MUL', 'DIV', '(', ')','^' ,'EOF','REGEX', 'STRING', ','
+INTEGER, PLUS, MINUS, MUL, DIV, LPAREN, RPAREN, POW, EOF, REGEX, STRING, COMMA, ID, FLOAT = (
+    'INTEGER', 'PLUS', 'MINUS', 'MUL', 'DIV', '(', ')','^' ,'EOF','REGEX', 'STRING', ',', 'ID', 'FLOAT'
 )
 
 # Token mapping for operators
@@ -18,6 +25,16 @@ token_map = {
             '^': POW,
             ',': COMMA
         }
+# Python source operators and their precedence, used by the Compiler
+python_operators = {
+    PLUS: ('+', 1),
+    MINUS: ('-', 1),
+    MUL: ('*', 2),
+    DIV: ('/', 2),
+    POW: ('**', 3)
+}
+ATOM_PRECEDENCE = 4
+
 # Binary operations mapping
 binary_operations = {
     PLUS: lambda x, y: x + y,
@@ -28,7 +45,18 @@ binary_operations = {
 }
 
 
+@lru_cache(maxsize=512)
+def compile_pattern(pattern):
+    """Compiles a REGEX() pattern once, keeping a bounded cache of compiled patterns"""
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise Exception(f"Invalid regex pattern: {str(e)}")
+
+
 class Token:
+    __slots__ = ('type', 'value')
+
     def __init__(self, type, value):
         self.type = type
         self.value = value
@@ -146,6 +174,26 @@ class StringTokenizer(ITokenizer):
 
 
 
+class IdentifierTokenizer(ITokenizer):
+    """Reads variable names; the REGEX keyword is matched case-insensitively"""
+    def __init__(self, reader: ICharacterReader):
+        self.reader = reader
+
+    def tokenize(self, char):
+        if not (char.isalpha() or char == '_'):
+            return None
+
+        result = ''
+        while self.reader.current_char() and (self.reader.current_char().isalnum()
+                                              or self.reader.current_char() == '_'):
+            result += self.reader.current_char()
+            self.reader.advance()
+
+        if result.lower() == 'regex':
+            return Token(REGEX, 'REGEX')
+        return Token(ID, result)
+
+
 class Lexer(ILexicalAnalyzer):
     def __init__(self, text, token_map):
         self.reader = TextReader(text)
@@ -154,6 +202,7 @@ class Lexer(ILexicalAnalyzer):
             IntegerTokenizer(self.reader),
             OperatorTokenizer(token_map),
             StringTokenizer(self.reader),
+            IdentifierTokenizer(self.reader),
         ]
 
     def error(self):
@@ -166,14 +215,6 @@ class Lexer(ILexicalAnalyzer):
             if char.isspace():
                 self.whitespace_handler.skip_whitespace()
                 continue
-            # Handle Regex keyword
-            if char.lower() == 'r':
-                text = ''
-                while self.reader.current_char() and self.reader.current_char().isalpha():
-                    text += self.reader.current_char()
-                    self.reader.advance()
-                if text.lower() == 'regex':
-                    return Token(REGEX, 'REGEX')
 
             for tokenizer in self.tokenizers:
                 if token := tokenizer.tokenize(char):
@@ -187,6 +228,70 @@ class Lexer(ILexicalAnalyzer):
         return Token(EOF, None)
 
 
+@lru_cache(maxsize=16)
+def master_pattern(operators):
+    """One alternation covering every token, built once per operator set"""
+    return re.compile(r'''
+        (?P<WHITESPACE>\s+)
+      | (?P<FLOAT>\d+\.\d*|\.\d+)
+      | (?P<INTEGER>\d+)
+      | (?P<STRING>"[^"]*")
+      | (?P<UNTERMINATED>")
+      | (?P<ID>[^\W\d]\w*)
+      | (?P<OPERATOR>{})
+      | (?P<INVALID>.)
+    '''.format('|'.join(re.escape(operator) for operator in operators)), re.VERBOSE | re.DOTALL)
+
+
+class RegexLexer(ILexicalAnalyzer):
+    """
+    Drop-in replacement for Lexer that tokenizes the whole expression in one
+    pass over a single compiled pattern. Also accepts float literals.
+    """
+    def __init__(self, text, token_map):
+        self.token_map = token_map
+        operators = tuple(sorted(token_map, key=len, reverse=True))
+        self.tokens = self.tokenize(master_pattern(operators), text)
+        self.pos = 0
+
+    def tokenize(self, pattern, text):
+        tokens = []
+        append = tokens.append
+        for match in pattern.finditer(text):
+            kind = match.lastgroup
+            value = match.group()
+            if kind == 'WHITESPACE':
+                continue
+            elif kind == 'OPERATOR':
+                append(Token(self.token_map[value], value))
+            elif kind == INTEGER:
+                append(Token(INTEGER, int(value)))
+            elif kind == ID:
+                if value.lower() == 'regex':
+                    append(Token(REGEX, 'REGEX'))
+                else:
+                    append(Token(ID, value))
+            elif kind == FLOAT:
+                append(Token(FLOAT, float(value)))
+            elif kind == STRING:
+                append(Token(STRING, value[1:-1]))
+            elif kind == 'UNTERMINATED':
+                raise Exception('Unterminated string')
+            else:
+                self.error()
+        append(Token(EOF, None))
+        return tokens
+
+    def error(self):
+        raise Exception('Invalid character')
+
+    def get_next_token(self):
+        token = self.tokens[self.pos]
+        if self.pos < len(self.tokens) - 1:
+            self.pos += 1
+        return token
+
+
 ###############################################################################
 #                                                                             #
 #  PARSER                                                                     #
@@ -194,10 +299,12 @@ class Lexer(ILexicalAnalyzer):
 ###############################################################################
 
 class AST(object):
-    pass
+    __slots__ = ()
 
 
 class BinOp(AST):
+    __slots__ = ('left', 'token', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
         self.token = self.op = op
@@ -205,6 +312,16 @@ class BinOp(AST):
 
 
 class Num(AST):
+    __slots__ = ('token', 'value')
+
+    def __init__(self, token):
+        self.token = token
+        self.value = token.value
+
+class Var(AST):
+    """A named variable resolved from the bindings at evaluation time"""
+    __slots__ = ('token', 'value')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
@@ -217,15 +334,39 @@ class IParser(ABC):
         pass
 
 class RegexOp(AST):
+    __slots__ = ('text', 'pattern', 'regex')
+
     def __init__(self, text, pattern):
         self.text = text
         self.pattern = pattern
+        self.regex = compile_pattern(pattern)
 
 class String(AST):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
 
+def children(node):
+    """Direct sub-nodes of a tree node"""
+    if isinstance(node, BinOp):
+        return node.left, node.right
+    if isinstance(node, RegexOp):
+        return node.text,
+    return ()
+
+
+def count_nodes(tree):
+    count = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(children(node))
+    return count
+
+
 class TokenReader:
     """Handles token reading and validation"""
     def __init__(self, lexer: ILexicalAnalyzer):
@@ -251,27 +392,39 @@ class ExpressionParser:
         self.token_reader = token_reader
 
     def factor(self):
-        """factor : INTEGER | LPAREN expr RPAREN"""
+        """factor : INTEGER | FLOAT | ID | regex_expr | LPAREN expr RPAREN"""
         token = self.token_reader.current_token
-        if token.type == INTEGER:
-            self.token_reader.eat(INTEGER)
+        if token.type == REGEX:
+            return self.regex_expr()
+        if token.type in (INTEGER, FLOAT):
+            self.token_reader.eat(token.type)
             return Num(token)
+        elif token.type == ID:
+            self.token_reader.eat(ID)
+            return Var(token)
         elif token.type == LPAREN:
             self.token_reader.eat(LPAREN)
             node = self.expr()
             self.token_reader.eat(RPAREN)
             return node
+        self.token_reader.error()
     def power(self):
         """
-        power : factor POW factor
+        power : factor (POW factor)*
+
+        ^ is right associative; the chain is collected first and folded from
+        the right, so long chains do not recurse.
         """
-        node = self.factor()
+        factors = [self.factor()]
+        operators = []
         while self.token_reader.current_token.type == POW:
-            token = self.token_reader.current_token
+            operators.append(self.token_reader.current_token)
             self.token_reader.eat(POW)
+            factors.append(self.factor())
 
-            node = BinOp(left=node, op=token, right=self.power())
-
+        node = factors.pop()
+        while operators:
+            node = BinOp(left=factors.pop(), op=operators.pop(), right=node)
         return node
 
     def term(self):
@@ -291,13 +444,11 @@ class ExpressionParser:
 
     def expr(self):
         """
-        expr   : regex_expr | term ((PLUS | MINUS) term)*
+        expr   : term ((PLUS | MINUS) term)*
         term   : power ((MUL | DIV) power)*
         power  : factor (POW power)?
-        factor : INTEGER | LPAREN expr RPAREN
+        factor : INTEGER | FLOAT | ID | regex_expr | LPAREN expr RPAREN
         """
-        if self.token_reader.current_token.type == REGEX:
-            return self.regex_expr()
         node = self.term()
 
         while self.token_reader.current_token.type in (PLUS, MINUS):
@@ -312,16 +463,21 @@ class ExpressionParser:
         return node
 
     def regex_expr(self):
-        """regex_expr : REGEX LPAREN STRING COMMA STRING RPAREN"""
+        """regex_expr : REGEX LPAREN (STRING | ID) COMMA STRING RPAREN"""
         self.token_reader.eat(REGEX)
         self.token_reader.eat(LPAREN)
         text_token = self.token_reader.current_token
-        self.token_reader.eat(STRING)
+        if text_token.type == ID:
+            self.token_reader.eat(ID)
+            text = Var(text_token)
+        else:
+            self.token_reader.eat(STRING)
+            text = String(text_token.value)
         self.token_reader.eat(COMMA)
         pattern_token = self.token_reader.current_token
         self.token_reader.eat(STRING)
         self.token_reader.eat(RPAREN)
-        return RegexOp(text_token.value, pattern_token.value)
+        return RegexOp(text, pattern_token.value)
     
 
 
@@ -332,8 +488,359 @@ class Parser(IParser):
         self.expression_parser = ExpressionParser(self.token_reader)
 
     def parse(self):
-        """Parses complete expression"""
-        return self.expression_parser.expr()
+        """Parses complete expression, trailing tokens are a syntax error"""
+        node = self.expression_parser.expr()
+        if self.token_reader.current_token.type != EOF:
+            self.token_reader.error()
+        return node
+
+
+class RegexSet:
+    """
+    Evaluates many REGEX() patterns against the same text.
+
+    Duplicate patterns are searched once. With combine=True the patterns are
+    scanned in a single pass: each one is wrapped in an optional lookahead
+    with its own group, behind a leading lookahead for the alternation of
+    all patterns, so the scan only stops where some pattern matches and
+    reports every pattern matching there. With the stdlib re engine the
+    alternation loses the literal-prefix shortcuts of the individual
+    patterns, so separate searches are usually faster (see benchmark.py).
+    Patterns that cannot be combined (groups, global flags) are always
+    searched individually.
+    """
+    default_flags = re.compile('').flags
+
+    def __init__(self, patterns, combine=False):
+        self.patterns = list(patterns)
+        self.unique = list(dict.fromkeys(self.patterns))
+        self.positions = {pattern: index for index, pattern in enumerate(self.unique)}
+        self.separate = []
+        self.indexes = []
+        for index, pattern in enumerate(self.unique):
+            regex = compile_pattern(pattern)
+            if not combine or regex.groups or regex.flags != self.default_flags:
+                self.separate.append((index, regex.search))
+            else:
+                self.indexes.append(index)
+
+        self.combined = None
+        if self.indexes:
+            parts = [self.unique[index] for index in self.indexes]
+            combined = '(?=' + '|'.join('(?:{})'.format(part) for part in parts) + ')' + \
+                ''.join('(?=({}))?'.format(part) for part in parts)
+            try:
+                self.combined = re.compile(combined)
+            except re.error:
+                self.separate.extend((index, compile_pattern(self.unique[index]).search)
+                                     for index in self.indexes)
+                self.indexes = []
+
+    def match(self, text):
+        """Returns one bool per pattern, in the order the patterns were given"""
+        text = str(text)
+        found = [False] * len(self.unique)
+        if self.combined is not None:
+            remaining = len(self.indexes)
+            for match in self.combined.finditer(text):
+                for index, value in zip(self.indexes, match.groups()):
+                    if value is not None and not found[index]:
+                        found[index] = True
+                        remaining -= 1
+                if not remaining:
+                    break
+        for index, search in self.separate:
+            found[index] = search(text) is not None
+        if len(self.unique) == len(self.patterns):
+            return found
+        return [found[self.positions[pattern]] for pattern in self.patterns]
+
+
+class IterativeParser(IParser):
+    """
+    Operator-precedence (shunting-yard) parser for the same grammar that
+    never recurses, so arbitrarily deep nesting only costs heap memory.
+    """
+    precedence = {PLUS: 1, MINUS: 1, MUL: 2, DIV: 2, POW: 3}
+
+    def __init__(self, lexer: ILexicalAnalyzer):
+        self.token_reader = TokenReader(lexer)
+
+    def regex_expr(self):
+        """regex_expr : REGEX LPAREN (STRING | ID) COMMA STRING RPAREN"""
+        return ExpressionParser(self.token_reader).regex_expr()
+
+    def reduce(self, operands, operators):
+        op = operators.pop()
+        right = operands.pop()
+        left = operands.pop()
+        operands.append(BinOp(left=left, op=op, right=right))
+
+    def parse(self):
+        reader = self.token_reader
+        operands = []
+        operators = []
+        expect_operand = True
+
+        while True:
+            token = reader.current_token
+            if expect_operand:
+                if token.type in (INTEGER, FLOAT):
+                    operands.append(Num(token))
+                elif token.type == ID:
+                    operands.append(Var(token))
+                elif token.type == REGEX:
+                    operands.append(self.regex_expr())
+                    expect_operand = False
+                    continue
+                elif token.type == LPAREN:
+                    operators.append(token)
+                    reader.eat(LPAREN)
+                    continue
+                else:
+                    reader.error()
+                reader.eat(token.type)
+                expect_operand = False
+
+            elif token.type in self.precedence:
+                precedence = self.precedence[token.type]
+                while operators and operators[-1].type != LPAREN and (
+                        self.precedence[operators[-1].type] > precedence
+                        or (self.precedence[operators[-1].type] == precedence and token.type != POW)):
+                    self.reduce(operands, operators)
+                operators.append(token)
+                reader.eat(token.type)
+                expect_operand = True
+
+            elif token.type == RPAREN:
+                while operators and operators[-1].type != LPAREN:
+                    self.reduce(operands, operators)
+                if not operators:
+                    reader.error()
+                operators.pop()
+                reader.eat(RPAREN)
+
+            elif token.type == EOF:
+                while operators:
+                    if operators[-1].type == LPAREN:
+                        reader.error()
+                    self.reduce(operands, operators)
+                return operands[0]
+
+            else:
+                reader.error()
+
+
+###############################################################################
+#                                                                             #
+#  STACK MACHINE                                                              #
+#                                                                             #
+###############################################################################
+
+# Instruction opcodes
+LOAD_CONST, LOAD_NAME, BINARY_OP, MATCH = range(4)
+# Superinstructions of Program: a BINARY_OP or MATCH fused with the load of its last operand
+BINARY_CONST, BINARY_NAME, MATCH_NAME = range(4, 7)
+
+
+class Program:
+    """
+    Postfix instruction list run by an iterative stack machine, as
+    (opcode, operand) pairs; stack_size is the deepest the value stack can
+    grow, known at compile time.
+
+    An operation whose last operand is a constant or a variable is fused
+    with its load (BINARY_CONST, BINARY_NAME, MATCH_NAME), which about
+    halves the number of instructions dispatched for typical KPIs.
+    """
+    def __init__(self):
+        self.instructions = []
+        self.stack_size = 0
+
+    def emit(self, opcode, operand, depth):
+        instructions = self.instructions
+        if instructions and opcode in (BINARY_OP, MATCH):
+            last, value = instructions[-1]
+            if opcode == BINARY_OP and last == LOAD_CONST:
+                instructions[-1] = (BINARY_CONST, (operand, value))
+                return
+            if opcode == BINARY_OP and last == LOAD_NAME:
+                instructions[-1] = (BINARY_NAME, (operand, value))
+                return
+            if opcode == MATCH and last == LOAD_NAME:
+                instructions[-1] = (MATCH_NAME, (operand, value))
+                return
+        instructions.append((opcode, operand))
+        self.stack_size = max(self.stack_size, depth)
+
+    @classmethod
+    def from_tree(cls, tree, budget=None):
+        """Compiles a tree by an iterative post-order walk"""
+        if budget is not None:
+            budget.check_nodes(tree)
+        program = cls()
+        depth = 0
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if isinstance(node, BinOp):
+                if expanded:
+                    depth -= 1
+                    operation = binary_operations[node.op.type]
+                    if budget is not None:
+                        operation = budget.guard(node.op.type, operation)
+                    program.emit(BINARY_OP, operation, depth)
+                else:
+                    stack.append((node, True))
+                    stack.append((node.right, False))
+                    stack.append((node.left, False))
+            elif isinstance(node, RegexOp):
+                if expanded:
+                    program.emit(MATCH, node.regex.search, depth)
+                else:
+                    stack.append((node, True))
+                    stack.append((node.text, False))
+            elif isinstance(node, Var):
+                depth += 1
+                program.emit(LOAD_NAME, node.value, depth)
+            elif isinstance(node, (Num, String)):
+                depth += 1
+                program.emit(LOAD_CONST, node.value, depth)
+            else:
+                raise Exception('Cannot compile {}'.format(type(node).__name__))
+        return program
+
+    def run(self, bindings=None):
+        if bindings is None:
+            bindings = {}
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        try:
+            for opcode, operand in self.instructions:
+                if opcode == BINARY_NAME:
+                    stack[-1] = operand[0](stack[-1], bindings[operand[1]])
+                elif opcode == BINARY_CONST:
+                    stack[-1] = operand[0](stack[-1], operand[1])
+                elif opcode == LOAD_NAME:
+                    push(bindings[operand])
+                elif opcode == LOAD_CONST:
+                    push(operand)
+                elif opcode == BINARY_OP:
+                    right = pop()
+                    stack[-1] = operand(stack[-1], right)
+                elif opcode == MATCH_NAME:
+                    push(operand[0](str(bindings[operand[1]])) is not None)
+                else:
+                    stack[-1] = operand(str(stack[-1])) is not None
+        except KeyError as e:
+            raise Exception(f"Undefined variable '{e.args[0]}'")
+        return stack[-1]
+
+    def __len__(self):
+        return len(self.instructions)
+
+
+###############################################################################
+#                                                                             #
+#  EVALUATION BUDGET                                                          #
+#                                                                             #
+###############################################################################
+
+class BudgetExceededError(Exception):
+    """Raised when evaluating an expression would exceed its EvaluationBudget"""
+    pass
+
+
+def estimate_bits(op_type, left, right):
+    """Upper bound on the size in bits of a binary operation's result"""
+    if isinstance(left, int) and isinstance(right, int):
+        if op_type == POW:
+            return left.bit_length() * right if right > 0 else 0
+        if op_type == MUL:
+            return left.bit_length() + right.bit_length()
+        return max(left.bit_length(), right.bit_length()) + 1
+    if op_type == MUL:
+        # Repeating a string builds it in memory just like a huge integer
+        if isinstance(left, str) and isinstance(right, int):
+            return len(left) * 8 * right
+        if isinstance(left, int) and isinstance(right, str):
+            return len(right) * 8 * left
+    return 0
+
+
+class EvaluationBudget:
+    """
+    Limits on the cost of evaluating one KPI: the number of nodes in its tree,
+    the exponent of integer ^ and the size in bits of results. Costs are
+    estimated from the operands before a * or ^ is computed, so a formula
+    like 9^9^9 fails with BudgetExceededError instead of stalling a worker.
+    """
+    __slots__ = ('max_bits', 'max_exponent', 'max_nodes')
+
+    def __init__(self, max_bits=65536, max_exponent=10000, max_nodes=10000):
+        self.max_bits = max_bits
+        self.max_exponent = max_exponent
+        self.max_nodes = max_nodes
+
+    def __eq__(self, other):
+        return isinstance(other, EvaluationBudget) and self.limits() == other.limits()
+
+    def __hash__(self):
+        return hash(self.limits())
+
+    def __repr__(self):
+        return 'EvaluationBudget(max_bits={}, max_exponent={}, max_nodes={})'.format(*self.limits())
+
+    def limits(self):
+        return self.max_bits, self.max_exponent, self.max_nodes
+
+    def check_nodes(self, tree):
+        count = count_nodes(tree)
+        if count > self.max_nodes:
+            raise BudgetExceededError(f"Expression has {count} nodes, budget allows {self.max_nodes}")
+
+    def check(self, op_type, left, right):
+        if op_type == POW and isinstance(right, int) and right > self.max_exponent:
+            raise BudgetExceededError(f"Exponent {right} exceeds budget of {self.max_exponent}")
+        bits = estimate_bits(op_type, left, right)
+        if bits > self.max_bits:
+            raise BudgetExceededError(f"Result of about {bits} bits exceeds budget of {self.max_bits}")
+
+    def guard(self, op_type, operation):
+        """
+        Wraps a binary operation so its operands are checked first. Only * and
+        ^ can grow a value by more than a bit, the others are returned as is.
+        """
+        if op_type not in (MUL, POW):
+            return operation
+        check = self.check
+        max_bits = self.max_bits
+
+        # Floats cannot grow without bound and small int products are
+        # checked inline, everything else goes through check()
+        if op_type == MUL:
+            def guarded(left, right):
+                if type(left) is float or type(right) is float or (
+                        type(left) is int and type(right) is int
+                        and left.bit_length() + right.bit_length() <= max_bits):
+                    return operation(left, right)
+                check(op_type, left, right)
+                return operation(left, right)
+        else:
+            max_exponent = self.max_exponent
+
+            def guarded(left, right):
+                if type(left) is float or type(right) is float or (
+                        type(left) is int and type(right) is int and right <= max_exponent
+                        and left.bit_length() * right <= max_bits):
+                    return operation(left, right)
+                check(op_type, left, right)
+                return operation(left, right)
+        return guarded
+
+
+DEFAULT_BUDGET = EvaluationBudget()
 
 
 ###############################################################################
@@ -353,32 +860,773 @@ class NodeVisitor(object):
 
 
 class Interpreter(NodeVisitor):
-    def __init__(self, parser):
+    def __init__(self, parser=None, budget=None):
         self.parser = parser
+        self.budget = budget
+        self.bindings = {}
+        self.checked = None
 
     def visit_RegexOp(self, node):
-        pattern = node.pattern
-        text = node.text
-        try:
-            match = re.search(pattern, text)
-            return bool(match)
-        except re.error as e:
-            raise Exception(f"Invalid regex pattern: {str(e)}")
+        text = str(self.visit(node.text))
+        return node.regex.search(text) is not None
 
     def visit_BinOp(self, node):
         left= self.visit(node.left)
         right = self.visit(node.right)
 
+        if self.budget is not None:
+            self.budget.check(node.op.type, left, right)
         operation = binary_operations[node.op.type]
         return operation(left, right)
 
     def visit_Num(self, node):
         return node.value
 
-    def interpret(self):
-        tree = self.parser.parse()
+    def visit_String(self, node):
+        return node.value
+
+    def visit_Var(self, node):
+        try:
+            return self.bindings[node.value]
+        except KeyError:
+            raise Exception(f"Undefined variable '{node.value}'")
+
+    def evaluate(self, tree, bindings=None):
+        """Evaluates an already parsed tree against the given variable bindings"""
+        # The node count only needs checking once per tree, not once per record
+        if self.budget is not None and tree is not self.checked:
+            self.budget.check_nodes(tree)
+            self.checked = tree
+        self.bindings = bindings or {}
         return self.visit(tree)
 
+    def interpret(self, bindings=None):
+        tree = self.parser.parse()
+        return self.evaluate(tree, bindings)
+
+
+###############################################################################
+#                                                                             #
+#  OPTIMIZER                                                                  #
+#                                                                             #
+###############################################################################
+
+def constant(value):
+    """Builds a Num node for a value computed at compile time"""
+    return Num(Token(FLOAT if isinstance(value, float) else INTEGER, value))
+
+
+def is_integer_constant(node, value):
+    return isinstance(node, Num) and type(node.value) is int and node.value == value
+
+
+class Optimizer(NodeVisitor):
+    """
+    Simplifies a parsed tree before evaluation: constant BinOps are folded,
+    x+0, 0+x, x-0, x*1, 1*x and x^1 are reduced to x, and REGEX() over a
+    literal text is replaced by its result. Identities assume numeric
+    variables and are not applied to REGEX() results, which are booleans.
+    `removed` holds the number of nodes the last optimize() call removed.
+    """
+    max_fold_bits = 4096
+
+    def __init__(self):
+        self.removed = 0
+
+    def visit_Num(self, node):
+        return node
+
+    def visit_String(self, node):
+        return node
+
+    def visit_Var(self, node):
+        return node
+
+    def visit_RegexOp(self, node):
+        text = self.visit(node.text)
+        if isinstance(text, String):
+            return constant(node.regex.search(text.value) is not None)
+        return node
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        op = node.op.type
+
+        if isinstance(left, Num) and isinstance(right, Num) and self.can_fold(op, left.value, right.value):
+            try:
+                return constant(binary_operations[op](left.value, right.value))
+            except (ArithmeticError, ValueError, TypeError):
+                pass  # leave the error to be raised at evaluation time
+
+        if not isinstance(left, RegexOp) and not isinstance(right, RegexOp):
+            if op in (PLUS, MINUS) and is_integer_constant(right, 0):
+                return left
+            if op == PLUS and is_integer_constant(left, 0):
+                return right
+            if op in (MUL, POW) and is_integer_constant(right, 1):
+                return left
+            if op == MUL and is_integer_constant(left, 1):
+                return right
+
+        if left is node.left and right is node.right:
+            return node
+        return BinOp(left, node.op, right)
+
+    def can_fold(self, op, left, right):
+        """Refuses to fold arithmetic whose result would be huge"""
+        return estimate_bits(op, left, right) <= self.max_fold_bits
+
+    def optimize(self, tree):
+        before = count_nodes(tree)
+        tree = self.visit(tree)
+        self.removed = before - count_nodes(tree)
+        return tree
+
+
+###############################################################################
+#                                                                             #
+#  BATCH EVALUATION                                                           #
+#                                                                             #
+###############################################################################
+
+class BatchEvaluator(NodeVisitor):
+    """
+    Evaluates a tree over whole columns of records at once: variables resolve
+    to NumPy arrays and each BinOp becomes a single array operation.
+
+    Integer results that would not fit in int64 are computed on Python ints
+    (object arrays) instead, so they match the row evaluators rather than
+    wrapping around. Those are checked against `budget` first.
+    """
+    INT64_SAFE = 2.0 ** 62
+
+    def __init__(self, columns, budget=DEFAULT_BUDGET):
+        import numpy as np
+        self.np = np
+        self.columns = columns
+        self.budget = budget
+        self.arrays = {}
+
+    def as_array(self, values):
+        """Numeric text columns from the input feed are converted to numbers"""
+        array = self.np.asarray(values)
+        if array.dtype.kind in 'OUS':
+            for dtype in (self.np.int64, self.np.float64):
+                try:
+                    return array.astype(dtype)
+                except (ValueError, TypeError, OverflowError):
+                    continue
+        return array
+
+    def is_integer(self, value):
+        np = self.np
+        if isinstance(value, np.ndarray):
+            if value.dtype.kind in 'iu':
+                return True
+            return value.dtype.kind == 'O' and all(type(item) is int for item in value.flat)
+        return isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+
+    def largest(self, value):
+        return max((abs(int(item)) for item in self.np.asarray(value, dtype=object).flat), default=0)
+
+    def integer_operation(self, op_type, left, right):
+        np = self.np
+        operation = binary_operations[op_type]
+        if op_type == POW and np.any(np.asarray(right) < 0):
+            # NumPy refuses negative integer powers, Python returns a float
+            return np.power(np.asarray(left, dtype=np.float64), np.asarray(right, dtype=np.float64))
+        try:
+            estimate = operation(np.asarray(left, dtype=np.float64), np.asarray(right, dtype=np.float64))
+            if np.all(np.abs(estimate) < self.INT64_SAFE):
+                return operation(np.asarray(left, dtype=np.int64), np.asarray(right, dtype=np.int64))
+        except OverflowError:
+            pass
+        # Out of int64 range: exact Python ints, like the row evaluators
+        if self.budget is not None:
+            self.budget.check(op_type, self.largest(left), self.largest(right))
+        return operation(np.asarray(left, dtype=object), np.asarray(right, dtype=object))
+
+    def visit_Num(self, node):
+        return node.value
+
+    def visit_String(self, node):
+        return node.value
+
+    def visit_Var(self, node):
+        array = self.arrays.get(node.value)
+        if array is None:
+            try:
+                array = self.arrays[node.value] = self.as_array(self.columns[node.value])
+            except KeyError:
+                raise Exception(f"Undefined variable '{node.value}'")
+        return array
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        if node.op.type != DIV and self.is_integer(left) and self.is_integer(right):
+            return self.integer_operation(node.op.type, left, right)
+        return binary_operations[node.op.type](left, right)
+
+    def visit_RegexOp(self, node):
+        search = node.regex.search
+        if isinstance(node.text, Var) and node.text.value in self.columns:
+            # Match the text as given, not its numeric conversion ('007' stays '007')
+            text = self.np.asarray(self.columns[node.text.value])
+        else:
+            text = self.visit(node.text)
+        if not isinstance(text, self.np.ndarray):
+            return search(str(text)) is not None
+        texts = text.astype(str).tolist()
+        return self.np.fromiter((search(value) is not None for value in texts),
+                                dtype=bool, count=len(texts))
+
+    def evaluate(self, tree):
+        size = len(next(iter(self.columns.values()))) if self.columns else 1
+        with self.np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            result = self.visit(tree)
+        return self.np.array(self.np.broadcast_to(result, (size,)))
+
+
+def evaluate_batch(ast, columns, budget=DEFAULT_BUDGET):
+    """
+    Evaluates a parsed tree for a batch of records given as a mapping of
+    variable name to column values, returning one result array per batch.
+    Per-row arithmetic errors such as division by zero yield inf/nan
+    instead of raising.
+    """
+    return BatchEvaluator(columns, budget).evaluate(ast)
+
+
+###############################################################################
+#                                                                             #
+#  COMPILER                                                                   #
+#                                                                             #
+###############################################################################
+
+class Compiler(NodeVisitor):
+    """
+    Translates a parsed tree into one Python function of the bindings, so an
+    evaluation runs as a single code object instead of a visit per node.
+    With a budget, * and ^ become calls to budget-checked functions.
+    """
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.namespace = {}
+
+    def visit_Num(self, node):
+        if isinstance(node.value, int) and node.value >= 0:
+            return repr(node.value), ATOM_PRECEDENCE
+        return self.constant(node.value), ATOM_PRECEDENCE
+
+    def visit_String(self, node):
+        return repr(node.value), ATOM_PRECEDENCE
+
+    def visit_Var(self, node):
+        return '_bindings[{}]'.format(repr(node.value)), ATOM_PRECEDENCE
+
+    def visit_BinOp(self, node):
+        operator, precedence = python_operators[node.op.type]
+        left, left_precedence = self.visit(node.left)
+        right, right_precedence = self.visit(node.right)
+        if self.budget is not None and node.op.type in (MUL, POW):
+            operation = self.budget.guard(node.op.type, binary_operations[node.op.type])
+            return '{}({}, {})'.format(self.constant(operation), left, right), ATOM_PRECEDENCE
+        # ^ is right associative, every other operator is left associative
+        if left_precedence < precedence or (node.op.type == POW and left_precedence == precedence):
+            left = '(' + left + ')'
+        if right_precedence < precedence or (node.op.type != POW and right_precedence == precedence):
+            right = '(' + right + ')'
+        return '{} {} {}'.format(left, operator, right), precedence
+
+    def visit_RegexOp(self, node):
+        text, _ = self.visit(node.text)
+        return '({}(str({})) is not None)'.format(self.constant(node.regex.search), text), ATOM_PRECEDENCE
+
+    def constant(self, value):
+        """Stores a value in the function globals and returns its name"""
+        name = '_c{}'.format(len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def compile(self, tree):
+        if self.budget is not None:
+            self.budget.check_nodes(tree)
+        self.namespace = {}
+        source, _ = self.visit(tree)
+        code = compile('lambda _bindings: ' + source, '<kpi>', 'eval')
+        return eval(code, self.namespace)
+
+
+###############################################################################
+#                                                                             #
+#  SHARED SUB-EXPRESSION DAG                                                  #
+#                                                                             #
+###############################################################################
+
+class ExpressionDAG:
+    """
+    Merges the trees of several KPIs into one DAG by hash-consing, so a
+    sub-expression shared between KPIs is computed once per record.
+
+    Every distinct node gets a slot; slots are in evaluation order and the
+    whole DAG is compiled into one straight-line Python function. If that
+    function raises, the record is re-evaluated slot by slot so a failing
+    KPI does not hide the results of the others.
+    """
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.slots = {}
+        self.opcodes = []
+        self.operands = []
+        self.arguments = []
+        self.outputs = {}
+        self.function = None
+
+    def intern(self, key, opcode, operand, arguments=()):
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = len(self.opcodes)
+            self.opcodes.append(opcode)
+            self.operands.append(operand)
+            self.arguments.append(arguments)
+        return slot
+
+    def add(self, name, tree):
+        """Adds a KPI tree, reusing every node already present in the DAG"""
+        if self.budget is not None:
+            self.budget.check_nodes(tree)
+        results = []
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if isinstance(node, BinOp):
+                if expanded:
+                    right = results.pop()
+                    left = results.pop()
+                    results.append(self.intern(('BinOp', node.op.type, left, right),
+                                               BINARY_OP, node.op.type, (left, right)))
+                else:
+                    stack.extend(((node, True), (node.right, False), (node.left, False)))
+            elif isinstance(node, RegexOp):
+                if expanded:
+                    text = results.pop()
+                    results.append(self.intern(('RegexOp', node.pattern, text),
+                                               MATCH, node.regex.search, (text,)))
+                else:
+                    stack.extend(((node, True), (node.text, False)))
+            elif isinstance(node, Var):
+                results.append(self.intern(('Var', node.value), LOAD_NAME, node.value))
+            elif isinstance(node, (Num, String)):
+                key = (type(node).__name__, type(node.value), node.value)
+                results.append(self.intern(key, LOAD_CONST, node.value))
+            else:
+                raise Exception('Cannot compile {}'.format(type(node).__name__))
+        self.outputs[name] = results.pop()
+        self.function = None
+
+    def compile(self):
+        """Generates one function computing every slot once and returning the outputs"""
+        namespace = {}
+        lines = ['def _evaluate(_bindings):']
+        for slot, (opcode, operand, arguments) in enumerate(zip(self.opcodes, self.operands, self.arguments)):
+            if opcode == LOAD_CONST:
+                name = '_c{}'.format(slot)
+                namespace[name] = operand
+                value = name
+            elif opcode == LOAD_NAME:
+                value = '_bindings[{}]'.format(repr(operand))
+            elif opcode == BINARY_OP and self.budget is not None and operand in (MUL, POW):
+                name = '_c{}'.format(slot)
+                namespace[name] = self.budget.guard(operand, binary_operations[operand])
+                value = '{}(_t{}, _t{})'.format(name, arguments[0], arguments[1])
+            elif opcode == BINARY_OP:
+                value = '_t{} {} _t{}'.format(arguments[0], python_operators[operand][0], arguments[1])
+            else:
+                name = '_c{}'.format(slot)
+                namespace[name] = operand
+                value = '{}(str(_t{})) is not None'.format(name, arguments[0])
+            lines.append('    _t{} = {}'.format(slot, value))
+        lines.append('    return ({},)'.format(', '.join('_t{}'.format(slot) for slot in self.outputs.values())))
+        exec(compile('\n'.join(lines), '<kpi dag>', 'exec'), namespace)
+        self.function = namespace['_evaluate']
+
+    def evaluate(self, bindings=None):
+        """
+        Returns {name: result} for every KPI in the DAG. A KPI whose
+        evaluation failed maps to the exception instead of a value.
+        """
+        bindings = bindings or {}
+        if self.function is None:
+            self.compile()
+        try:
+            return dict(zip(self.outputs, self.function(bindings)))
+        except Exception:
+            return self.evaluate_slots(bindings)
+
+    def evaluate_slots(self, bindings):
+        values = []
+        for opcode, operand, arguments in zip(self.opcodes, self.operands, self.arguments):
+            inputs = [values[argument] for argument in arguments]
+            failed = next((value for value in inputs if isinstance(value, Exception)), None)
+            if failed is not None:
+                values.append(failed)
+                continue
+            try:
+                if opcode == LOAD_CONST:
+                    values.append(operand)
+                elif opcode == LOAD_NAME:
+                    values.append(bindings[operand])
+                elif opcode == BINARY_OP:
+                    if self.budget is not None:
+                        self.budget.check(operand, *inputs)
+                    values.append(binary_operations[operand](*inputs))
+                else:
+                    values.append(operand(str(inputs[0])) is not None)
+            except KeyError:
+                values.append(Exception(f"Undefined variable '{operand}'"))
+            except Exception as e:
+                values.append(e)
+        return {name: values[slot] for name, slot in self.outputs.items()}
+
+    def __len__(self):
+        return len(self.opcodes)
+
+
+class ExpressionGroup:
+    """KPIs of one asset under different budgets: one ExpressionDAG per budget, results merged"""
+    def __init__(self, dags):
+        self.dags = dags
+
+    def evaluate(self, bindings=None):
+        results = {}
+        for dag in self.dags:
+            results.update(dag.evaluate(bindings))
+        return results
+
+    def evaluate_slots(self, bindings):
+        results = {}
+        for dag in self.dags:
+            results.update(dag.evaluate_slots(bindings))
+        return results
+
+    def __len__(self):
+        return sum(len(dag) for dag in self.dags)
+
+
+###############################################################################
+#                                                                             #
+#  SERIALIZATION                                                              #
+#                                                                             #
+###############################################################################
+
+# Compact compiled form: header, then a node table in evaluation order with
+# one kind byte and three integer arguments per node, plus a constant pool.
+FORMAT_MAGIC = b'KPIX'
+FORMAT_VERSION = 1
+FORMAT_HEADER = struct.Struct('>4sBc')
+NODE_NUM, NODE_STRING, NODE_VAR, NODE_BINOP, NODE_REGEX = range(5)
+SERIALIZED_OPERATORS = (PLUS, MINUS, MUL, DIV, POW)
+operator_symbols = {token_type: symbol for symbol, token_type in token_map.items()}
+
+
+def dumps(tree):
+    """Serializes a tree into the versioned node-table format"""
+    kinds = array('B')
+    arguments = array('i')
+    constants = []
+    constant_index = {}
+
+    def add_constant(value):
+        key = (type(value), value)
+        if key not in constant_index:
+            constant_index[key] = len(constants)
+            constants.append(value)
+        return constant_index[key]
+
+    def add_node(kind, first=0, second=0, third=0):
+        kinds.append(kind)
+        arguments.extend((first, second, third))
+        return len(kinds) - 1
+
+    results = []
+    stack = [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if isinstance(node, BinOp):
+            if expanded:
+                right = results.pop()
+                left = results.pop()
+                operator = SERIALIZED_OPERATORS.index(node.op.type)
+                results.append(add_node(NODE_BINOP, operator, left, right))
+            else:
+                stack.extend(((node, True), (node.right, False), (node.left, False)))
+        elif isinstance(node, RegexOp):
+            if expanded:
+                results.append(add_node(NODE_REGEX, results.pop(), add_constant(node.pattern)))
+            else:
+                stack.extend(((node, True), (node.text, False)))
+        elif isinstance(node, Num):
+            results.append(add_node(NODE_NUM, add_constant(node.value)))
+        elif isinstance(node, String):
+            results.append(add_node(NODE_STRING, add_constant(node.value)))
+        elif isinstance(node, Var):
+            results.append(add_node(NODE_VAR, add_constant(node.value)))
+        else:
+            raise Exception('Cannot serialize {}'.format(type(node).__name__))
+
+    byteorder = b'<' if sys.byteorder == 'little' else b'>'
+    header = FORMAT_HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, byteorder)
+    return header + marshal.dumps((kinds.tobytes(), arguments.tobytes(), tuple(constants)))
+
+
+def loads(data):
+    """Rebuilds a tree from dumps() output without running the lexer or parser"""
+    try:
+        magic, version, byteorder = FORMAT_HEADER.unpack_from(data)
+    except struct.error:
+        raise Exception('Invalid compiled expression')
+    if magic != FORMAT_MAGIC or version != FORMAT_VERSION:
+        raise Exception(f'Unsupported compiled expression format version {version}')
+
+    kind_bytes, argument_bytes, constants = marshal.loads(data[FORMAT_HEADER.size:])
+    kinds = array('B', kind_bytes)
+    arguments = array('i')
+    arguments.frombytes(argument_bytes)
+    if byteorder != (b'<' if sys.byteorder == 'little' else b'>'):
+        arguments.byteswap()
+
+    nodes = []
+    for index, kind in enumerate(kinds):
+        first, second, third = arguments[3 * index:3 * index + 3]
+        if kind == NODE_NUM:
+            nodes.append(constant(constants[first]))
+        elif kind == NODE_STRING:
+            nodes.append(String(constants[first]))
+        elif kind == NODE_VAR:
+            nodes.append(Var(Token(ID, constants[first])))
+        elif kind == NODE_BINOP:
+            op_type = SERIALIZED_OPERATORS[first]
+            nodes.append(BinOp(nodes[second], Token(op_type, operator_symbols[op_type]), nodes[third]))
+        elif kind == NODE_REGEX:
+            nodes.append(RegexOp(nodes[first], constants[second]))
+        else:
+            raise Exception('Invalid compiled expression')
+    return nodes[-1]
+
+
+###############################################################################
+#                                                                             #
+#  EXPRESSION CACHE                                                           #
+#                                                                             #
+###############################################################################
+
+class CompiledExpression:
+    """A parsed expression that can be evaluated any number of times"""
+    __slots__ = ('expression', 'tree', 'function', 'removed_nodes', 'program')
+
+    def __init__(self, expression, tree, function=None, removed_nodes=0, program=None):
+        self.expression = expression
+        self.tree = tree
+        self.function = function
+        self.removed_nodes = removed_nodes
+        self.program = program
+
+    def evaluate(self, bindings=None):
+        if self.function is None:
+            if self.program is None:
+                self.program = Program.from_tree(self.tree)
+            return self.program.run(bindings)
+        try:
+            return self.function(bindings or {})
+        except KeyError as e:
+            raise Exception(f"Undefined variable '{e.args[0]}'")
+
+    def evaluate_batch(self, columns):
+        return evaluate_batch(self.tree, columns)
+
+
+class ExpressionCache:
+    """
+    LRU cache of compiled expressions keyed on the expression text, so each
+    distinct expression is tokenized and parsed only once. Compile errors
+    are cached as well (up to `maxsize` of them) and raised again on lookup.
+
+    Every expression is evaluated under `budget` (None disables the limits);
+    get() accepts a different EvaluationBudget for an individual KPI.
+    """
+    def __init__(self, maxsize=256, token_map=token_map, lexer_class=RegexLexer, budget=DEFAULT_BUDGET):
+        self.maxsize = maxsize
+        self.token_map = token_map
+        self.lexer_class = lexer_class
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._groups = OrderedDict()
+        self._failures = OrderedDict()
+        self._serialized = {}
+        self._lock = threading.Lock()
+
+    def compile(self, expression, budget=None):
+        budget = budget or self.budget
+        with self._lock:
+            data = self._serialized.get(expression) if budget == self.budget else None
+        if data is not None:
+            try:
+                return self.compile_tree(expression, loads(data), budget)
+            except BudgetExceededError:
+                raise
+            except Exception as e:
+                print(f"Recompiling '{expression}': {str(e)}")
+            finally:
+                with self._lock:
+                    self._serialized.pop(expression, None)
+        try:
+            tree = Parser(self.lexer_class(expression, self.token_map)).parse()
+        except RecursionError:
+            tree = IterativeParser(self.lexer_class(expression, self.token_map)).parse()
+        return self.compile_tree(expression, tree, budget)
+
+    def compile_tree(self, expression, tree, budget=None):
+        budget = budget or self.budget
+        if budget is not None:
+            budget.check_nodes(tree)
+        optimizer = Optimizer()
+        try:
+            tree = optimizer.optimize(tree)
+            function = Compiler(budget).compile(tree)
+        except (SyntaxError, RecursionError, MemoryError):
+            # Too deeply nested for the recursive passes, run it on the stack machine
+            return CompiledExpression(expression, tree, program=Program.from_tree(tree, budget))
+        return CompiledExpression(expression, tree, function, optimizer.removed)
+
+    def lookup(self, entries, key, build):
+        with self._lock:
+            compiled = entries.get(key)
+            if compiled is not None:
+                entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            failure = self._failures.get(key)
+            if failure is not None:
+                self._failures.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if failure is not None:
+            raise failure.with_traceback(None)
+
+        try:
+            compiled = build(key)
+        except Exception as e:
+            # Remember the error so an invalid expression is not parsed again for every record
+            with self._lock:
+                self._failures[key] = e
+                while len(self._failures) > self.maxsize:
+                    self._failures.popitem(last=False)
+            raise
+
+        with self._lock:
+            entries[key] = compiled
+            entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        return compiled
+
+    def get(self, expression, budget=None):
+        if budget is None or budget == self.budget:
+            return self.lookup(self._entries, expression, self.compile)
+        return self.lookup(self._entries, (expression, budget), lambda key: self.compile(*key))
+
+    def build_group(self, equations):
+        dags = {}
+        for equation in equations:
+            if not isinstance(equation, tuple):
+                equation = (equation, equation)
+            name, expression, budget = equation if len(equation) == 3 else equation + (None,)
+            if budget is None:
+                budget = self.budget
+            dag = dags.get(budget)
+            if dag is None:
+                dag = dags[budget] = ExpressionDAG(budget)
+            dag.add(name, self.get(expression, budget).tree)
+        for dag in dags.values():
+            dag.compile()
+        if len(dags) == 1:
+            return dag
+        return ExpressionGroup(list(dags.values()))
+
+    def get_group(self, equations):
+        """
+        Returns an ExpressionDAG evaluating all the given equations together,
+        e.g. every KPI attached to one asset. Equations are (name, expression)
+        pairs such as (kpi_id, expression) and results are keyed on the name,
+        so two KPIs with the same expression each get a result. A bare
+        expression is its own name. A (name, expression, budget) triple
+        evaluates that KPI under its own EvaluationBudget; KPIs are only
+        merged with others sharing their budget.
+        """
+        return self.lookup(self._groups, tuple(equations), self.build_group)
+
+    def preload(self, serialized):
+        """
+        Registers {expression: dumps() output}, e.g. loaded from a
+        CompiledExpressionStore. Nothing is decoded up front: the first
+        get() of such an expression rebuilds its tree from the compact form
+        instead of running the lexer and parser.
+        """
+        with self._lock:
+            self._serialized.update(serialized)
+        return len(serialized)
+
+    def export(self):
+        """Serialized compiled form of every cached expression"""
+        with self._lock:
+            entries = list(self._entries.items())
+            serialized = dict(self._serialized)
+        serialized.update((expression, dumps(compiled.tree))
+                          for expression, compiled in entries if isinstance(expression, str))
+        return serialized
+
+    @staticmethod
+    def uses(key, expression):
+        """Whether a cache key (expression, (expression, budget) or group) involves the expression"""
+        if not isinstance(key, tuple):
+            return key == expression
+        return any(item == expression or (isinstance(item, tuple) and item[1] == expression) for item in key)
+
+    def evict(self, expression):
+        with self._lock:
+            self._serialized.pop(expression, None)
+            for entries in (self._entries, self._groups, self._failures):
+                for key in [key for key in entries if self.uses(key, expression)]:
+                    del entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self._failures.clear()
+            self._serialized.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'groups': len(self._groups),
+                'failures': len(self._failures),
+                'preloaded': len(self._serialized),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
 
 # def main():
 #     while True:
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class KpiMonitorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'kpi_monitor'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('kpi_monitor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KPIChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(max_length=10)),
+                ('asset_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('kpi_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
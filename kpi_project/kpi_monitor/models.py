@@ -1,9 +1,21 @@
 from django.db import models
 
 # Create your models here.
-from django.db import models
+from django.db import models, transaction
+
+
+class AtomicSaveMixin:
+    """
+    Saves inside a transaction, so the KPIChange row the post_save signal
+    writes commits or rolls back together with the edit. Deletes already
+    send post_delete inside the deletion's transaction.
+    """
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
-class KPI(models.Model):
+class KPI(AtomicSaveMixin, models.Model):
     name = models.CharField(max_length=100)
     expression = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
@@ -11,10 +23,26 @@ class KPI(models.Model):
 
 
 
-class AssetKPI(models.Model):
+class AssetKPI(AtomicSaveMixin, models.Model):
     asset_id = models.CharField(max_length=100)
     kpi = models.ForeignKey(KPI, on_delete=models.CASCADE)
 
     class Meta:
         unique_together = ('asset_id', 'kpi')
-    
\ No newline at end of file
+    
+
+
+class KPIChange(models.Model):
+    """
+    Append-only log of KPI and AssetKPI edits, written from model signals.
+    The auto-increment id is the cursor pipeline workers poll with.
+    """
+    SAVE = 'save'
+    DELETE = 'delete'
+
+    model_name = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10)
+    asset_id = models.CharField(max_length=100, blank=True, null=True)
+    kpi_id = models.BigIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
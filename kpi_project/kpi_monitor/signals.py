@@ -0,0 +1,44 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import KPI, AssetKPI, KPIChange
+
+
+# Changes made with queryset.update() or bulk_create() do not send these
+# signals and are therefore not logged.
+
+@receiver(post_save, sender=KPI)
+def log_kpi_save(sender, instance, **kwargs):
+    KPIChange.objects.create(model_name='kpi', object_id=instance.pk,
+                             action=KPIChange.SAVE, kpi_id=instance.pk)
+
+
+@receiver(post_delete, sender=KPI)
+def log_kpi_delete(sender, instance, **kwargs):
+    KPIChange.objects.create(model_name='kpi', object_id=instance.pk,
+                             action=KPIChange.DELETE, kpi_id=instance.pk)
+
+
+@receiver(pre_save, sender=AssetKPI)
+def remember_previous_asset(sender, instance, **kwargs):
+    instance._previous_asset_id = None
+    if instance.pk is not None:
+        instance._previous_asset_id = (
+            AssetKPI.objects.filter(pk=instance.pk).values_list('asset_id', flat=True).first())
+
+
+@receiver(post_save, sender=AssetKPI)
+def log_asset_kpi_save(sender, instance, **kwargs):
+    asset_ids = [instance.asset_id]
+    previous = getattr(instance, '_previous_asset_id', None)
+    if previous is not None and previous != instance.asset_id:
+        # The link moved to another asset, the old one has to be refreshed too
+        asset_ids.append(previous)
+    for asset_id in asset_ids:
+        KPIChange.objects.create(model_name='assetkpi', object_id=instance.pk, action=KPIChange.SAVE,
+                                 asset_id=asset_id, kpi_id=instance.kpi_id)
+
+
+@receiver(post_delete, sender=AssetKPI)
+def log_asset_kpi_delete(sender, instance, **kwargs):
+    KPIChange.objects.create(model_name='assetkpi', object_id=instance.pk, action=KPIChange.DELETE,
+                             asset_id=instance.asset_id, kpi_id=instance.kpi_id)
@@ -2,9 +2,10 @@ from django.test import TestCase
 
 # Create your tests here.
 from django.test import TestCase
+from unittest import mock
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import KPI, AssetKPI
+from .models import KPI, AssetKPI, KPIChange
 
 class KPITests(APITestCase):
     def test_create_kpi(self):
@@ -40,4 +41,50 @@ class AssetKPITests(APITestCase):
         }
         response = self.client.post('/api/asset-kpis/', data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        self.assertEqual(AssetKPI.objects.count(), 1)
\ No newline at end of file
+        self.assertEqual(AssetKPI.objects.count(), 1)
+
+class KPIChangeTests(APITestCase):
+    def setUp(self):
+        self.kpi = KPI.objects.create(name='Test KPI', expression='ATTR+50')
+
+    def test_kpi_update_is_logged(self):
+        """Test editing a KPI expression appends a change"""
+        self.kpi.expression = 'ATTR*2'
+        self.kpi.save()
+        change = KPIChange.objects.order_by('-id').first()
+        self.assertEqual(change.model_name, 'kpi')
+        self.assertEqual(change.kpi_id, self.kpi.id)
+        self.assertEqual(change.action, KPIChange.SAVE)
+
+    def test_link_is_logged_with_asset(self):
+        """Test linking an asset records the asset id"""
+        data = {'asset_id': '123', 'kpi': self.kpi.id}
+        self.client.post('/api/asset-kpis/', data, format='json')
+        change = KPIChange.objects.order_by('-id').first()
+        self.assertEqual(change.model_name, 'assetkpi')
+        self.assertEqual(change.asset_id, '123')
+
+    def test_moving_link_logs_both_assets(self):
+        """Test moving a link to another asset logs the old and the new asset"""
+        link = AssetKPI.objects.create(asset_id='123', kpi=self.kpi)
+        cursor = KPIChange.objects.order_by('-id').first().id
+        link.asset_id = '456'
+        link.save()
+        assets = set(KPIChange.objects.filter(id__gt=cursor).values_list('asset_id', flat=True))
+        self.assertEqual(assets, {'123', '456'})
+
+    def test_kpi_delete_logs_cascaded_links(self):
+        """Test deleting a KPI also logs the links removed with it"""
+        AssetKPI.objects.create(asset_id='123', kpi=self.kpi)
+        cursor = KPIChange.objects.order_by('-id').first().id
+        self.kpi.delete()
+        changes = KPIChange.objects.filter(id__gt=cursor, action=KPIChange.DELETE)
+        self.assertEqual(set(changes.values_list('model_name', flat=True)), {'kpi', 'assetkpi'})
+
+    def test_failed_log_rolls_back_edit(self):
+        """Test an edit is not committed when its change row cannot be written"""
+        self.kpi.expression = 'ATTR*2'
+        with mock.patch.object(KPIChange.objects, 'create', side_effect=RuntimeError('log failed')):
+            with self.assertRaises(RuntimeError):
+                self.kpi.save()
+        self.assertEqual(KPI.objects.get(pk=self.kpi.pk).expression, 'ATTR+50')
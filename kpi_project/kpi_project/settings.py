@@ -80,6 +80,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL lets the KPI pipeline keep reading while the API writes
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
     }
 }
 
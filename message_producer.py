@@ -2,15 +2,17 @@ from abc import ABC, abstractmethod
 import json
 from datetime import datetime
 import sqlite3
+import time
 
 import os
 
 class OutputMessage:
-    def __init__(self,asset_id,attribute_id, timestamp, value):
+    def __init__(self,asset_id,attribute_id, timestamp, value, kpi_id=None):
         self.asset_id = asset_id
         self.attribute_id = attribute_id
         self.timestamp = timestamp
         self.value =value
+        self.kpi_id = kpi_id  # KPI the value was computed by, None if unknown
 
 
 class IMessageFormatter(ABC):
@@ -32,6 +34,23 @@ class IMessageStorage(ABC):
     def disconnect(self):
         pass
 
+    last_batch_size = 0  # Messages in the last batch written out
+
+    def flush(self) -> bool:
+        """Writes out buffered messages, storages that write immediately have nothing to do"""
+        return True
+
+    def store_rows(self, rows) -> bool:
+        """
+        Stores (asset_id, attribute_id, timestamp, value, kpi_id) rows,
+        storages that can write them in one go override this
+        """
+        return all([self.store_message(OutputMessage(*row)) for row in rows])
+
+    def flush_if_due(self) -> bool:
+        """flush() if the buffered messages have waited long enough"""
+        return True
+
 class ITimestampGenerator(ABC):
     @abstractmethod
     def generate(self) -> str:
@@ -52,16 +71,34 @@ class JsonMessageFormatter(IMessageFormatter):
             "asset_id": message.asset_id,
             "attribute_id": message.attribute_id,
             "timestamp": message.timestamp,
-            "value": message.value
+            "value": message.value,
+            "kpi_id": message.kpi_id
         })
 
 
 
 class SQLiteMessageStorage(IMessageStorage):
-    def __init__(self, db_path):
+    """
+    Stores messages in SQLite, in WAL mode with synchronous=NORMAL so a
+    commit does not wait for an fsync.
+
+    With batch_size > 1 messages are buffered and written with one
+    executemany and one commit once batch_size are waiting, on flush() or
+    disconnect(), and once the oldest has waited flush_interval seconds.
+    There is no timer thread (the connection belongs to the thread that
+    opened it): the interval is checked when a message is stored and by
+    flush_if_due(), which a caller with a quiet stream must poll from the
+    storage's thread. A failed batch is rolled back and dropped as a whole,
+    and flush() returns False.
+    """
+    def __init__(self, db_path, batch_size=1, flush_interval=1.0):
         self.db_path = db_path
         self.connection = None
         self.cursor = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.pending_since = None
 
     def connect(self):
         try:
@@ -70,6 +107,8 @@ class SQLiteMessageStorage(IMessageStorage):
                 os.makedirs(directory)
 
             self.connection = sqlite3.connect(self.db_path)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
             self.cursor = self.connection.cursor()
             self.create_table()
         except sqlite3.Error:
@@ -77,7 +116,10 @@ class SQLiteMessageStorage(IMessageStorage):
 
     def disconnect(self):
         if self.connection:
+            self.flush()
             self.connection.close()
+            self.connection = None
+            self.cursor = None
 
     def create_table(self):
 
@@ -87,9 +129,14 @@ class SQLiteMessageStorage(IMessageStorage):
                 asset_id TEXT NOT NULL,
                 attribute_id TEXT NOT NULL,
                 timestamp TEXT NOT NULL,
-                value TEXT NOT NULL
+                value TEXT NOT NULL,
+                kpi_id INTEGER
             )
         ''')
+        columns = [row[1] for row in self.cursor.execute("PRAGMA table_info(output_messages)")]
+        if 'kpi_id' not in columns:
+            # Table created before messages carried their KPI
+            self.cursor.execute("ALTER TABLE output_messages ADD COLUMN kpi_id INTEGER")
         self.connection.commit()
 
     # def store_message(self, message: OutputMessage) -> bool:
@@ -105,14 +152,22 @@ class SQLiteMessageStorage(IMessageStorage):
     #         return False
 
     def store_message(self, message: OutputMessage) -> bool:
+        if self.batch_size > 1:
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending.append((message.asset_id, message.attribute_id, message.timestamp, message.value,
+                                 message.kpi_id))
+            if len(self.pending) >= self.batch_size:
+                return self.flush()
+            return self.flush_if_due()
         try:
             if not self.connection or not self.cursor:
                 raise sqlite3.Error("Database connection not established")
 
             self.cursor.execute('''
-                INSERT INTO output_messages (asset_id, attribute_id, timestamp, value)
-                VALUES (?, ?, ?, ?)
-            ''', (message.asset_id, message.attribute_id, message.timestamp, message.value))
+                INSERT INTO output_messages (asset_id, attribute_id, timestamp, value, kpi_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (message.asset_id, message.attribute_id, message.timestamp, message.value, message.kpi_id))
             self.connection.commit()
             print(f"Successfully stored message for asset {message.asset_id}")
             return True
@@ -123,6 +178,42 @@ class SQLiteMessageStorage(IMessageStorage):
             print(f"Error storing message: {str(e)}")
             return False
 
+    def store_rows(self, rows) -> bool:
+        """Buffers the rows like store_message(), so they are written in one executemany with the rest"""
+        if not self.pending:
+            self.pending_since = time.monotonic()
+        self.pending.extend(rows)
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return self.flush_if_due()
+
+    def flush_if_due(self) -> bool:
+        if self.pending and time.monotonic() - self.pending_since >= self.flush_interval:
+            return self.flush()
+        return True
+
+    def flush(self) -> bool:
+        if not self.pending:
+            return True
+        batch, self.pending = self.pending, []
+        self.last_batch_size = len(batch)
+        try:
+            if not self.connection or not self.cursor:
+                raise sqlite3.Error("Database connection not established")
+
+            self.cursor.executemany('''
+                INSERT INTO output_messages (asset_id, attribute_id, timestamp, value, kpi_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', batch)
+            self.connection.commit()
+            print(f"Successfully stored {len(batch)} messages")
+            return True
+        except sqlite3.Error as e:
+            if self.connection:
+                self.connection.rollback()
+            print(f"SQLite error storing batch of {len(batch)} messages: {str(e)}")
+            return False
+
 class MessageProducer:
     def __init__(self, formatter: IMessageFormatter, storage: IMessageStorage,timestamp_generator: ITimestampGenerator):
         self.formatter = formatter
@@ -130,28 +221,59 @@ class MessageProducer:
         self.timestamp_generator = timestamp_generator
 
 
-    def produce_message(self, asset_id, attribute_id, value):
+    def produce_message(self, asset_id, attribute_id, value, kpi_id=None):
         message = OutputMessage(
             asset_id=asset_id,
             attribute_id=attribute_id,
             timestamp=self.timestamp_generator.generate(),
-            value=value
+            value=value,
+            kpi_id=kpi_id
         )
 
         formatted_message = self.formatter.format_message(message)
 
         if self.storage.store_message(message):
             return json.loads(formatted_message)
+        elif self.storage.last_batch_size > 1:
+            # The whole batch this message was flushed with is lost, not only this one
+            raise Exception(f"Failed to store batch of {self.storage.last_batch_size} messages")
         else:
             raise Exception("Failed to store message")
 
+    def produce_batch(self, asset_ids, attribute_ids, values, kpi_id=None):
+        """
+        Stores one message per row of the given columns, all with the same
+        timestamp and kpi_id, without building an OutputMessage per row.
+        Returns the number of messages stored.
+        """
+        columns = [column.tolist() if hasattr(column, 'tolist') else column
+                   for column in (asset_ids, attribute_ids, values)]
+        timestamp = self.timestamp_generator.generate()
+        rows = [(asset_id, attribute_id, timestamp, str(value), kpi_id)
+                for asset_id, attribute_id, value in zip(*columns)]
+        if not rows:
+            return 0
+        if not self.storage.store_rows(rows):
+            raise Exception(f"Failed to store batch of {self.storage.last_batch_size} messages")
+        return len(rows)
+
+    def flush(self):
+        """Writes out the messages the storage is buffering, raises if the batch failed"""
+        if not self.storage.flush():
+            raise Exception(f"Failed to store batch of {self.storage.last_batch_size} messages")
+
+    def flush_if_due(self):
+        """flush() once the storage's flush_interval has passed, for callers polling a quiet stream"""
+        if not self.storage.flush_if_due():
+            raise Exception(f"Failed to store batch of {self.storage.last_batch_size} messages")
+
 
 
 class DatabaseMessage:
     @staticmethod
-    def create(db_path = "output_messages.db"):
+    def create(db_path = "output_messages.db", batch_size=1, flush_interval=1.0):
         formatter = JsonMessageFormatter()
-        storage = SQLiteMessageStorage(db_path)
+        storage = SQLiteMessageStorage(db_path, batch_size=batch_size, flush_interval=flush_interval)
         timestamp_generator = UTCTimestampGenerator()
         storage.connect()
         return MessageProducer(formatter, storage, timestamp_generator=timestamp_generator)
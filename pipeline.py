@@ -0,0 +1,262 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from data_ingestor import DataIngestor
+
+
+END = object()  # Put on a queue by a stage that has no more items
+
+
+class MonitoredQueue(asyncio.Queue):
+    """asyncio.Queue that counts what goes through it and how often producers had to wait"""
+    def __init__(self, name, maxsize=0):
+        super().__init__(maxsize)
+        self.name = name
+        self.items = 0
+        self.peak = 0
+        self.waits = 0
+
+    async def put(self, item):
+        if self.full():
+            self.waits += 1
+        await super().put(item)
+        if item is not END:
+            self.items += 1
+        if self.qsize() > self.peak:
+            self.peak = self.qsize()
+
+    def stats(self):
+        return {'depth': self.qsize(), 'maxsize': self.maxsize, 'peak': self.peak,
+                'items': self.items, 'waits': self.waits}
+
+
+class Pipeline:
+    """
+    Runs read -> equation lookup -> evaluation -> storage as asyncio tasks
+    connected by bounded queues, so a slow stage only stalls the others
+    once the queue in front of it is full.
+
+    `evaluate(equations, bindings)` gets the (kpi_id, expression) pairs of a
+    record's asset and returns {kpi_id: result or exception}; each result is
+    stored with its kpi_id.
+
+    Reading and lookups run in thread executors, evaluation runs on the
+    event loop, and storage runs on one dedicated thread. The message
+    producer is created on that thread by `create_message_producer`, since
+    a sqlite3 connection belongs to the thread that opened it.
+
+    `maxsize` bounds every queue (an int, or a dict by queue name:
+    'records', 'equations', 'results'); 0 means unbounded. Up to
+    `store_batch_size` queued results are stored per trip to the storage
+    thread.
+
+    When run() is cancelled (Ctrl-C under asyncio.run) the reader stops and
+    everything already read is still evaluated and stored before run()
+    returns, so no record the DataFilter admitted is lost. The reader thread
+    has exited by then, so the filter's state can be saved safely.
+    """
+    def __init__(self, data_ingestor: DataIngestor, create_equation_processor, evaluate,
+                 create_message_producer, maxsize=1000, store_batch_size=256):
+        self.data_ingestor = data_ingestor
+        self.create_equation_processor = create_equation_processor
+        self.evaluate = evaluate
+        self.create_message_producer = create_message_producer
+        self.store_batch_size = store_batch_size
+        sizes = maxsize if isinstance(maxsize, dict) else {}
+        default = 1000 if isinstance(maxsize, dict) else maxsize
+        self.queues = {name: MonitoredQueue(name, sizes.get(name, default))
+                       for name in ('records', 'equations', 'results')}
+        self.reader_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline-reader')
+        self.lookup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline-lookup')
+        self.storage_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline-storage')
+        self.message_producer = None
+        self.stopping = False  # Abort: stages quit without draining
+        self.draining = False  # Stop reading, let what was read flow through
+
+    def stats(self):
+        """Depth, configured size, peak depth, items passed and full-queue waits of every queue"""
+        return {name: queue.stats() for name, queue in self.queues.items()}
+
+    def read(self, loop):
+        """Runs on the reader thread, blocking while the records queue is full"""
+        queue = self.queues['records']
+        try:
+            for record in self.data_ingestor.process():
+                future = asyncio.run_coroutine_threadsafe(queue.put(record), loop)
+                while True:
+                    try:
+                        future.result(timeout=0.5)
+                        break
+                    except TimeoutError:
+                        if self.stopping:
+                            future.cancel()
+                            return
+                if self.stopping:
+                    return
+                if self.draining:
+                    break
+        finally:
+            if not self.stopping:
+                asyncio.run_coroutine_threadsafe(queue.put(END), loop).result()
+
+    def lookup(self, record):
+        equation_processor = self.create_equation_processor(record['asset_id'])
+        equations = equation_processor.process_equations(record)
+        if not equations:
+            return None
+        return equations, equation_processor.bind(record)
+
+    async def lookup_stage(self, loop):
+        records, equations = self.queues['records'], self.queues['equations']
+        while (record := await records.get()) is not END:
+            try:
+                found = await loop.run_in_executor(self.lookup_executor, self.lookup, record)
+            except Exception as e:
+                print(f"Error processing record {record}: {str(e)}")
+                continue
+            if found is None:
+                print(f"No equation found for asset_id: {record['asset_id']}")
+                continue
+            await equations.put((record, *found))
+        await equations.put(END)
+
+    async def evaluate_stage(self):
+        equations, results = self.queues['equations'], self.queues['results']
+        while (item := await equations.get()) is not END:
+            record, processed_equations, bindings = item
+            try:
+                evaluated = self.evaluate(processed_equations, bindings)
+            except Exception as e:
+                print(f"Error processing record {record}: {str(e)}")
+                continue
+            expressions = dict(processed_equations)
+            for kpi_id, result in evaluated.items():
+                if isinstance(result, Exception):
+                    print(f"Error evaluating '{expressions.get(kpi_id)}' for record {record}: {str(result)}")
+                    continue
+                await results.put((record, kpi_id, result))
+        await results.put(END)
+
+    def store(self, items, idle=False):
+        """Runs on the storage thread, flushes buffered messages once no more results are waiting"""
+        for record, kpi_id, result in items:
+            try:
+                output_message = self.message_producer.produce_message(
+                    asset_id=record['asset_id'],
+                    attribute_id=record['attribute_id'],
+                    value=str(result),
+                    kpi_id=kpi_id
+                )
+                print(f"Processed message: {output_message}")
+            except Exception as e:
+                print(f"Error processing record {record}: {str(e)}")
+        if idle:
+            try:
+                self.message_producer.flush()
+            except Exception as e:
+                print(f"Error storing messages: {str(e)}")
+
+    async def storage_stage(self, loop):
+        results = self.queues['results']
+        done = False
+        while not done:
+            items = [await results.get()]
+            while len(items) < self.store_batch_size and not results.empty():
+                items.append(results.get_nowait())
+            if items[-1] is END:
+                items.pop()
+                done = True
+            if items:
+                await loop.run_in_executor(self.storage_executor, self.store, items, done or results.empty())
+
+    def stop_reader(self):
+        stop = getattr(self.data_ingestor.data_reader, 'stop', None)
+        if stop is not None:
+            # A following reader would otherwise wait for more data forever
+            stop()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopping = False
+        self.draining = False
+        self.message_producer = await loop.run_in_executor(self.storage_executor, self.create_message_producer)
+        reader = loop.run_in_executor(self.reader_executor, self.read, loop)
+        stages = asyncio.gather(reader, self.lookup_stage(loop), self.evaluate_stage(), self.storage_stage(loop))
+        try:
+            try:
+                await asyncio.shield(stages)
+            except asyncio.CancelledError:
+                # The reader puts END once it stops, every stage finishes what is queued
+                self.draining = True
+                self.stop_reader()
+                await stages
+                raise
+        finally:
+            self.stopping = True
+            self.stop_reader()
+            if not stages.done():
+                stages.cancel()
+            await loop.run_in_executor(self.storage_executor, self.close)
+            # The reader must be done with the DataFilter before its state is saved
+            await loop.run_in_executor(None, self.reader_executor.shutdown)
+            for executor in (self.lookup_executor, self.storage_executor):
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """Runs on the storage thread"""
+        if self.message_producer and self.message_producer.storage:
+            self.message_producer.storage.disconnect()
+
+
+def store_batches(data_ingestor: DataIngestor, create_equation_processor, evaluate_batch, message_producer):
+    """
+    Column-wise counterpart of Pipeline for a batch reader such as
+    CSVBatchReader. The rows of each RecordBatch from
+    DataIngestor.process_batches() are grouped by KPI across assets, each
+    KPI is evaluated once over all its rows with
+    `evaluate_batch(expression, columns)` and handed to
+    MessageProducer.produce_batch(). The storage commits when its batch_size
+    fills up and once per RecordBatch. Returns the number of messages produced.
+    """
+    stored = 0
+    for batch in data_ingestor.process_batches():
+        asset_ids = batch.column('asset_id')
+        equations_of = {}  # asset_id -> (equation processor, [(kpi_id, expression), ...])
+        groups = {}  # (kpi_id, expression) -> (equation processor, row indices)
+        for index, asset_id in enumerate(asset_ids.tolist() if hasattr(asset_ids, 'tolist') else asset_ids):
+            asset_id = str(asset_id)
+            found = equations_of.get(asset_id)
+            if found is None:
+                found = equations_of[asset_id] = lookup_batch_equations(create_equation_processor, asset_id)
+            processor, equations = found
+            for equation in equations:
+                group = groups.get(equation)
+                if group is None:
+                    group = groups[equation] = (processor, [])
+                group[1].append(index)
+        for (kpi_id, equation), (processor, indices) in groups.items():
+            kpi_batch = batch if len(indices) == len(batch) else batch.take(indices)
+            try:
+                values = evaluate_batch(equation, processor.bind_columns(kpi_batch.columns))
+                stored += message_producer.produce_batch(kpi_batch.column('asset_id'),
+                                                         kpi_batch.column('attribute_id'),
+                                                         values, kpi_id=kpi_id)
+            except Exception as e:
+                print(f"Error evaluating '{equation}' for {len(kpi_batch)} records: {str(e)}")
+        try:
+            message_producer.flush()
+        except Exception as e:
+            print(f"Error storing messages: {str(e)}")
+    return stored
+
+
+def lookup_batch_equations(create_equation_processor, asset_id):
+    try:
+        processor = create_equation_processor(asset_id)
+        equations = processor.batch_equations()
+    except Exception as e:
+        print(f"Error looking up equations of asset_id {asset_id}: {str(e)}")
+        return None, []
+    if not equations:
+        print(f"No equation found for asset_id: {asset_id}")
+    return processor, equations
@@ -1,58 +1,104 @@
-from data_ingestor import CSVDataReader, DataFilter, DataIngestor
-from equation_reader import FileConfigReader, EquationReader, VariableReplacer, EquationProcessor
-from interpreter import Lexer, Parser, Interpreter, token_map
+import asyncio
+import os
+import sys
+
+from data_ingestor import CSVBatchReader, CSVDataReader, DataFilter, DataIngestor
+from equation_reader import (FileConfigReader, KPIRegistry, RegistryEquationReader, VariableBinder,
+                             EquationProcessor, CompiledExpressionStore, SQLiteConnectionProvider)
+from interpreter import ExpressionCache
 from message_producer import DatabaseMessage
+from pipeline import Pipeline, store_batches
+
+
+KPI_DB_PATH = os.path.join("kpi_project", "db.sqlite3")
+kpi_connections = SQLiteConnectionProvider(KPI_DB_PATH)
+expression_cache = ExpressionCache(maxsize=256)
+compiled_store = CompiledExpressionStore("compiled_kpis.db")
+
+
+def evict_stale_expressions(asset_ids, stale_expressions):
+    for expression in stale_expressions:
+        expression_cache.evict(expression)
+
+
+kpi_registry = KPIRegistry(KPI_DB_PATH, connection_provider=kpi_connections, on_change=evict_stale_expressions)
 
 
 def create_equation_processor(asset_id):
-    equation_reader = EquationReader(asset_id=asset_id, db_path=".\kpi_project\db.sqlite3")
-    variable_processor = VariableReplacer()
+    equation_reader = RegistryEquationReader(kpi_registry, asset_id)
+    variable_processor = VariableBinder()
     return EquationProcessor(equation_reader, variable_processor)
 
 
-def process_equation(equation_str, record):
-    lexer = Lexer(equation_str,token_map)
-    parser = Parser(lexer)
-    interpreter = Interpreter(parser)
-    return interpreter.interpret()
+def process_equation(equation_str, bindings):
+    return expression_cache.get(equation_str).evaluate(bindings)
 
 
-def main():
-    csv_reader = CSVDataReader('asset_data.csv')
-    data_filter = DataFilter()
-    data_ingestor = DataIngestor(csv_reader, data_filter, interval=5)
-    message_producer = DatabaseMessage.create(db_path="output_messages.db")
+def process_equation_batch(equation_str, columns):
+    return expression_cache.get(equation_str).evaluate_batch(columns)
 
+
+def process_equations(equations, bindings):
+    """
+    Evaluates every KPI of an asset together, sharing common sub-expressions.
+    Takes (kpi_id, expression) pairs and returns {kpi_id: result}.
+    """
     try:
-        for record in data_ingestor.process():
+        return expression_cache.get_group(equations).evaluate(bindings)
+    except Exception:
+        # One of the KPIs does not compile, evaluate them one by one
+        results = {}
+        for kpi_id, equation in equations:
             try:
-                equation_processor = create_equation_processor(record['asset_id'])
-                processed_equation = equation_processor.process_equation(record)
-
-                if processed_equation:
-                    result = process_equation(processed_equation, record)  # Added record parameter
-                    output_message = message_producer.produce_message(
-                        asset_id=record['asset_id'],
-                        attribute_id=record['attribute_id'],
-                        value=str(result)
-                    )
-                    print(f"Processed message: {output_message}")
-                else:
-                    print(f"No equation found for asset_id: {record['asset_id']}")
-
+                results[kpi_id] = process_equation(equation, bindings)
             except Exception as e:
-                print(f"Error processing record {record}: {str(e)}")
-                continue
+                results[kpi_id] = e
+        return results
 
+
+def main():
+    csv_reader = CSVDataReader('asset_data.csv', follow=True)
+    data_filter = DataFilter()
+    data_filter.load("filter_state.bin")
+    data_ingestor = DataIngestor(csv_reader, data_filter, interval=None)
+    kpi_connections.enable_wal()
+    expression_cache.preload(compiled_store.load())
+    pipeline = Pipeline(data_ingestor, create_equation_processor, process_equations,
+                        lambda: DatabaseMessage.create(db_path="output_messages.db", batch_size=256),
+                        maxsize=1000)
+
+    try:
+        asyncio.run(pipeline.run())
     except KeyboardInterrupt:
         print("\nStopping the application...")
     except Exception as e:
         print(f"Application error: {str(e)}")
     finally:
-        csv_reader.close_file()
-        if message_producer and message_producer.storage:
-            message_producer.storage.disconnect()
+        print(f"Queue stats: {pipeline.stats()}")
+        compiled_store.save(expression_cache.export())
+        data_filter.save("filter_state.bin")
+        kpi_registry.close()
+        kpi_connections.close()
+
+
+def main_batches():
+    """Ingests asset_data.csv once, column-wise, instead of following it record by record"""
+    data_filter = DataFilter()
+    data_filter.load("filter_state.bin")
+    data_ingestor = DataIngestor(CSVBatchReader('asset_data.csv'), data_filter, interval=None)
+    message_producer = DatabaseMessage.create(db_path="output_messages.db", batch_size=256)
+    try:
+        stored = store_batches(data_ingestor, create_equation_processor, process_equation_batch, message_producer)
+        print(f"Stored {stored} messages")
+    finally:
+        message_producer.storage.disconnect()
+        data_filter.save("filter_state.bin")
+        kpi_registry.close()
+        kpi_connections.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if '--batches' in sys.argv[1:]:
+        main_batches()
+    else:
+        main()
\ No newline at end of file
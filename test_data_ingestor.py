@@ -0,0 +1,347 @@
+import contextlib
+import io
+import marshal
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from data_ingestor import (ArrowIPCDataReader, CSVBatchReader, CSVDataReader, DataFilter, DataIngestor,
+                           MmapCSVDataReader, ParquetDataReader, PartitionedIngestor, RecordBatch, parse_timestamp,
+                           parse_timestamps, partition_of)
+
+
+def quietly(function, *args):
+    """Runs function with its error prints swallowed"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+class TemporaryDirectoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def write(self, name, text):
+        path = self.path(name)
+        with open(path, 'w', newline='') as file:
+            file.write(text)
+        return path
+
+
+ROWS = ('asset_id,attribute_id,timestamp,value\n'
+        '123,1,2024-11-24T11:44:18Z[UTC],E\n'
+        '124,34,2024-11-24T11:44:23Z[UTC],F')
+
+
+class CSVDataReaderTests(TemporaryDirectoryTestCase):
+    def follow(self, path):
+        """Runs a following reader in a thread, returns it and the list its records go to"""
+        reader = CSVDataReader(path, follow=True, poll_interval=0.01)
+        records = []
+
+        def read():
+            for record in reader.read_records():
+                records.append(record)
+        thread = threading.Thread(target=read)
+        thread.start()
+
+        def stop():
+            reader.stop()
+            thread.join(5)
+        self.addCleanup(stop)
+        return reader, records, stop
+
+    def wait_for(self, records, count):
+        deadline = time.monotonic() + 5
+        while len(records) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return [record['asset_id'] for record in records]
+
+    def test_reads_the_file_once_without_follow(self):
+        path = self.write('data.csv', ROWS + '\n')
+        self.assertEqual([record['value'] for record in CSVDataReader(path).read_records()], ['E', 'F'])
+        self.assertEqual(quietly(lambda: list(CSVDataReader(self.path('missing.csv')).read_records())), [])
+
+    def test_follows_appended_lines(self):
+        path = self.write('data.csv', ROWS + '\n')
+        reader, records, stop = self.follow(path)
+        self.assertEqual(self.wait_for(records, 2), ['123', '124'])
+        with open(path, 'a') as file:
+            file.write('125,12,2024-11-24T11:44:28Z[UTC],')
+            file.flush()
+            time.sleep(0.05)
+            # Half a line is held back until the rest of it is written
+            self.assertEqual(len(records), 2)
+            file.write('G\n')
+        self.assertEqual(self.wait_for(records, 3), ['123', '124', '125'])
+        self.assertEqual(records[2]['value'], 'G')
+        stop()
+        self.assertIsNone(reader.file)
+
+    def test_follows_rotation_and_truncation(self):
+        path = self.write('data.csv', ROWS + '\n')
+        _, records, _ = self.follow(path)
+        self.wait_for(records, 2)
+        os.rename(path, self.path('data.csv.1'))
+        self.write('data.csv', 'asset_id,attribute_id,timestamp,value\n126,1,2024-11-24T11:44:30Z[UTC],H\n')
+        self.assertEqual(self.wait_for(records, 3)[2:], ['126'])
+        self.write('data.csv', 'asset_id,attribute_id,timestamp,value\n')
+        time.sleep(0.05)
+        with open(path, 'a') as file:
+            file.write('127,1,2024-11-24T11:44:31Z[UTC],I\n')
+        self.assertEqual(self.wait_for(records, 4)[3:], ['127'])
+
+
+class CSVBatchReaderTests(TemporaryDirectoryTestCase):
+    TEXT = ('asset_id,attribute_id,timestamp,value\n'
+            '1,10,2024-11-24T11:44:18Z[UTC],"a,b"\n'
+            '2,20,2024-11-24T11:44:19Z[UTC]\n'
+            '3,30,2024-11-24T11:44:20Z[UTC],"say ""hi"""\n'
+            '4,40,2024-11-24T11:44:21Z[UTC],E\n'
+            '5,50,2024-11-24T11:44:22Z[UTC],F\n')
+
+    def test_chunks_quoted_fields_and_skips_malformed_rows(self):
+        path = self.write('data.csv', self.TEXT)
+        reader = CSVBatchReader(path, chunk_size=2)
+        batches = quietly(lambda: list(reader.read_batches()))
+        self.assertEqual([len(batch) for batch in batches], [1, 2, 1])
+        self.assertEqual(reader.skipped, 1)
+        self.assertEqual(batches[1].column('value'), ('say "hi"', 'E'))
+        records = quietly(lambda: list(CSVBatchReader(path).read_records()))
+        self.assertEqual([record['value'] for record in records], ['a,b', 'say "hi"', 'E', 'F'])
+
+    def test_partitions_split_the_assets(self):
+        path = self.write('data.csv', self.TEXT)
+        partitions = [quietly(lambda: [asset_id for batch in CSVBatchReader(path, partition=(index, 3)).read_batches()
+                                       for asset_id in batch.column('asset_id')])
+                      for index in range(3)]
+        self.assertEqual(sorted(sum(partitions, [])), ['1', '3', '4', '5'])
+        for index, asset_ids in enumerate(partitions):
+            self.assertTrue(all(partition_of(asset_id, 3) == index for asset_id in asset_ids))
+
+    def test_batches_go_through_the_filter(self):
+        path = self.write('data.csv', ROWS + '\n123,2,2024-11-24T11:44:10Z[UTC],G\n')
+        batches = list(DataIngestor(CSVBatchReader(path), DataFilter(), interval=None).process_batches())
+        self.assertEqual([list(batch.records()) for batch in batches],
+                         [list(CSVDataReader(self.write('expected.csv', ROWS)).read_records())])
+
+
+def count_rows(batch):
+    """PartitionedIngestor handler, runs in the worker"""
+    return len(batch)
+
+
+class PartitionedIngestorTests(TemporaryDirectoryTestCase):
+    def setUp(self):
+        super().setUp()
+        header = 'asset_id,attribute_id,timestamp,value\n'
+        # The second file repeats an old reading of asset 1, which the worker owning it drops
+        self.write('a.csv', header + ''.join(f'{asset_id},1,2024-11-24T11:44:1{asset_id}Z[UTC],E\n'
+                                             for asset_id in range(6)))
+        self.write('b.csv', header + '1,1,2024-11-24T11:44:10Z[UTC],E\n6,1,2024-11-24T11:44:16Z[UTC],E\n')
+        self.write('notes.txt', 'not a csv')
+
+    def test_every_asset_is_read_by_one_worker(self):
+        summaries = list(PartitionedIngestor(self.directory.name, workers=2).process())
+        self.assertEqual(sorted(summary['partition'] for summary in summaries), [0, 1])
+        self.assertEqual(sum(summary['rows'] for summary in summaries), 8)
+        self.assertEqual(sum(summary['kept'] for summary in summaries), 7)
+        for summary in summaries:
+            asset_ids = [asset_id for batch in summary['results'] for asset_id in batch.column('asset_id')]
+            self.assertTrue(all(partition_of(asset_id, 2) == summary['partition'] for asset_id in asset_ids))
+
+    def test_handler_runs_in_the_workers(self):
+        summaries = PartitionedIngestor(self.path('*.csv'), workers=2, handler=count_rows).process()
+        self.assertEqual(sum(sum(summary['results']) for summary in summaries), 7)
+        self.assertEqual(quietly(lambda: list(PartitionedIngestor(self.path('*.json')).process())), [])
+
+
+class MmapCSVDataReaderTests(TemporaryDirectoryTestCase):
+    def test_reads_last_line_without_newline(self):
+        path = self.write('data.csv', ROWS)
+        records = list(MmapCSVDataReader(path).read_records())
+        self.assertEqual([record['asset_id'] for record in records], ['123', '124'])
+        self.assertEqual(records, list(CSVDataReader(path).read_records()))
+        self.assertEqual(len(records), sum(len(batch) for batch in CSVBatchReader(path).read_batches()))
+
+    def test_complete_lines_only_leaves_the_tail(self):
+        path = self.write('data.csv', ROWS)
+        reader = MmapCSVDataReader(path, complete_lines_only=True)
+        self.assertEqual([record['asset_id'] for record in reader.read_records()], ['123'])
+        with open(path, 'a') as file:
+            file.write('\n')
+        reader = MmapCSVDataReader(path, complete_lines_only=True)
+        self.assertEqual([record['asset_id'] for record in reader.read_records()], ['124'])
+
+    def test_resumes_from_checkpoint(self):
+        path = self.write('data.csv', ROWS)
+        self.assertEqual(len(list(MmapCSVDataReader(path).read_records())), 2)
+        self.assertEqual(list(MmapCSVDataReader(path).read_records()), [])
+        with open(path, 'a') as file:
+            file.write('\n125,12,2024-11-24T11:44:28Z[UTC],G\n')
+        records = list(MmapCSVDataReader(path).read_records())
+        self.assertEqual([record['asset_id'] for record in records], ['125'])
+
+    def test_checkpoint_restores_filter_state(self):
+        path = self.write('data.csv', ROWS)
+        data_filter = DataFilter()
+        reader = MmapCSVDataReader(path, data_filter=data_filter)
+        self.assertEqual(len(list(DataIngestor(reader, data_filter, interval=None).process())), 2)
+        restored = DataFilter()
+        list(MmapCSVDataReader(path, data_filter=restored).read_records())
+        self.assertEqual(restored.watermark('124'), data_filter.watermark('124'))
+
+
+class ArrowReaderTests(TemporaryDirectoryTestCase):
+    def write_parquet(self, name, asset_ids, asset_id_type):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({
+            'asset_id': pa.array(asset_ids, type=asset_id_type),
+            'attribute_id': pa.array(['1'] * len(asset_ids)),
+            'timestamp': pa.array(['2024-11-24T11:44:18Z'] * len(asset_ids)),
+            'value': pa.array(['5'] * len(asset_ids)),
+        })
+        path = self.path(name)
+        pq.write_table(table, path)
+        return path
+
+    def test_null_asset_ids_are_dropped(self):
+        import pyarrow as pa
+
+        for asset_ids, asset_id_type in ((['1', None], pa.string()), ([1, None], pa.int64())):
+            with self.subTest(asset_id_type=str(asset_id_type)):
+                path = self.write_parquet('nulls.parquet', asset_ids, asset_id_type)
+                batches = quietly(lambda: list(DataIngestor(ParquetDataReader(path), DataFilter(),
+                                                            interval=None).process_batches()))
+                self.assertEqual([len(batch) for batch in batches], [1])
+                records = quietly(lambda: list(DataIngestor(ParquetDataReader(path), DataFilter(),
+                                                            interval=None).process()))
+                self.assertEqual([record['asset_id'] for record in records], [asset_ids[0]])
+
+    def test_typed_asset_ids_share_watermarks_with_text(self):
+        import pyarrow as pa
+
+        path = self.write_parquet('ints.parquet', [7, 7], pa.int64())
+        data_filter = DataFilter()
+        batches = list(DataIngestor(ParquetDataReader(path), data_filter, interval=None).process_batches())
+        self.assertEqual([len(batch) for batch in batches], [1])
+        self.assertIsNotNone(data_filter.watermark('7'))
+
+    def test_ipc_file_and_stream_with_projection(self):
+        import pyarrow as pa
+
+        table = pa.table({
+            'asset_id': pa.array(['1', '2']),
+            'attribute_id': pa.array([3, 4]),
+            'timestamp': pa.array([parse_timestamp('2024-11-24T11:44:18Z') // 1000] * 2,
+                                  type=pa.timestamp('ms', 'UTC')),
+            'value': pa.array(['E', 'F']),
+            'unused': pa.array([0, 0]),
+        })
+        for name, open_writer in (('data.arrow', pa.ipc.new_file), ('data.arrows', pa.ipc.new_stream)):
+            with self.subTest(format=name):
+                path = self.path(name)
+                with pa.OSFile(path, 'wb') as sink, open_writer(sink, table.schema) as writer:
+                    writer.write_table(table)
+                batches = list(ArrowIPCDataReader(path).read_batches())
+                self.assertEqual(list(batches[0].columns), ['asset_id', 'attribute_id', 'timestamp', 'value'])
+                self.assertEqual(batches[0].column('timestamp').tolist(),
+                                 [parse_timestamp('2024-11-24T11:44:18Z')] * 2)
+                records = list(ArrowIPCDataReader(path, columns=['asset_id', 'value']).read_records())
+                self.assertEqual(records, [{'asset_id': '1', 'value': 'E'}, {'asset_id': '2', 'value': 'F'}])
+                kept = list(DataIngestor(ArrowIPCDataReader(path), DataFilter(), interval=None).process_batches())
+                self.assertEqual([len(batch) for batch in kept], [2])
+
+
+def record(asset_id, seconds):
+    return {'asset_id': asset_id, 'timestamp': f'2024-11-24T11:44:{seconds:02d}Z[UTC]'}
+
+
+class DataFilterTests(TemporaryDirectoryTestCase):
+    # (asset_id, seconds) in arrival order
+    ARRIVALS = [('a', 10), ('b', 5), ('a', 10), ('a', 8), ('a', 12), ('b', 4), ('a', 9), ('b', 6)]
+
+    def admitted(self, data_filter):
+        return [data_filter.is_new_records(record(*arrival)) for arrival in self.ARRIVALS]
+
+    def test_watermarks_are_per_asset(self):
+        data_filter = DataFilter()
+        self.assertEqual(self.admitted(data_filter), [True, True, False, False, True, False, False, True])
+        self.assertEqual(data_filter.watermark('a'), parse_timestamp('2024-11-24T11:44:12Z'))
+        self.assertIsNone(data_filter.watermark('c'))
+        self.assertEqual(data_filter.last_timestamp, data_filter.watermark('a'))
+
+    def test_allowed_lateness(self):
+        data_filter = DataFilter(allowed_lateness=2)
+        self.assertEqual(self.admitted(data_filter), [True, True, True, True, True, True, False, True])
+        self.assertEqual(data_filter.watermark('b'), parse_timestamp('2024-11-24T11:44:06Z'))
+
+    def test_filter_batch_matches_is_new_records(self):
+        for allowed_lateness in (0, 2):
+            with self.subTest(allowed_lateness=allowed_lateness):
+                batch = RecordBatch({'asset_id': tuple(asset_id for asset_id, _ in self.ARRIVALS),
+                                     'timestamp': tuple(record(*arrival)['timestamp'] for arrival in self.ARRIVALS)},
+                                    len(self.ARRIVALS))
+                kept = DataFilter(allowed_lateness).filter_batch(batch)
+                expected = [arrival for arrival, new in zip(self.ARRIVALS, self.admitted(DataFilter(allowed_lateness)))
+                            if new]
+                self.assertEqual([(row['asset_id'], int(row['timestamp'][17:19])) for row in kept.records()], expected)
+
+    def test_invalid_records_are_dropped(self):
+        data_filter = DataFilter()
+        for invalid in ({'asset_id': 'a'}, {'asset_id': 'a', 'timestamp': 'E'}, {'asset_id': None, 'timestamp': '0'}):
+            with self.subTest(record=invalid):
+                self.assertFalse(quietly(data_filter.is_new_records, invalid))
+
+    def test_save_and_load(self):
+        data_filter = DataFilter()
+        self.admitted(data_filter)
+        path = self.path('filter_state.bin')
+        data_filter.save(path)
+        restored = DataFilter()
+        self.assertTrue(restored.load(path))
+        self.assertEqual(restored.slots, data_filter.slots)
+        self.assertEqual(restored.watermarks, data_filter.watermarks)
+        self.assertEqual(restored.last_timestamp, data_filter.last_timestamp)
+        self.assertFalse(restored.is_new_records(record('a', 12)))
+        self.assertFalse(DataFilter().load(self.path('missing.bin')))
+        with self.assertRaisesRegex(Exception, 'Unsupported filter state version 2'):
+            DataFilter().load_state(marshal.dumps((2, [], b'')))
+
+
+class ParseTimestampTests(unittest.TestCase):
+    VALID = {
+        '2024-11-24T11:44:18Z[UTC]': 1732448658000000,
+        '2024-11-24T11:44:18Z': 1732448658000000,
+        '2024-02-29T00:00:00Z': 1709164800000000,
+        '2024-11-24T12:44:18+01:00': 1732448658000000,
+        '1970-01-01T00:00:00': 0,
+    }
+    INVALID = ['2024/11/24T11:44:18Z', '2024-11-24T+1:44:18Z', '2024-11-24T11:4 :18Z', '2024-1\u00b2-24T11:44:18Z',
+               '2023-02-29T00:00:00Z', '2024-11-24T24:00:00Z', '2024-11-24T11:44:18Z[UTC]x', 'E', '']
+
+    def test_parses_feed_and_iso_formats(self):
+        for value, expected in self.VALID.items():
+            with self.subTest(value=value):
+                self.assertEqual(parse_timestamp(value), expected)
+        self.assertEqual(parse_timestamps(list(self.VALID)).tolist(), list(self.VALID.values()))
+        self.assertEqual(parse_timestamp(5), 5)
+
+    def test_rejects_malformed_timestamps(self):
+        for value in self.INVALID + [None, 1.5]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parse_timestamp(value)
+                with self.assertRaises(ValueError):
+                    parse_timestamps(['2024-11-24T11:44:18Z', value])
+
+
+if __name__ == '__main__':
+    unittest.main()
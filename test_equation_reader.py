@@ -0,0 +1,231 @@
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from equation_reader import (BulkEquationReader, ConfigWatcher, EquationConfigReader, EquationReader, FileConfigReader,
+                             KPIChangeFeed, KPIRegistry, RegistryEquationReader, SQLiteConnectionProvider)
+from interpreter import ExpressionCache
+
+SCHEMA = """
+    CREATE TABLE kpi_monitor_kpi (id INTEGER PRIMARY KEY, name TEXT, expression TEXT NOT NULL);
+    CREATE TABLE kpi_monitor_assetkpi (id INTEGER PRIMARY KEY, asset_id TEXT NOT NULL, kpi_id INTEGER NOT NULL);
+"""
+
+
+class KPIDatabaseTestCase(unittest.TestCase):
+    """A scratch KPI database with the kpi_monitor tables the pipeline reads"""
+    schema = SCHEMA
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, 'kpi.sqlite3')
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            connection.executescript(self.schema)
+
+    def execute(self, sql, parameters=()):
+        """Commits a statement from another connection, as the Django app would"""
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            with connection:
+                connection.execute(sql, parameters)
+
+    def add_kpi(self, kpi_id, expression, *asset_ids):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            with connection:
+                connection.execute("INSERT INTO kpi_monitor_kpi (id, name, expression) VALUES (?, ?, ?)",
+                                   (kpi_id, f'kpi {kpi_id}', expression))
+                connection.executemany("INSERT INTO kpi_monitor_assetkpi (asset_id, kpi_id) VALUES (?, ?)",
+                                       [(asset_id, kpi_id) for asset_id in asset_ids])
+
+
+class KPIRegistryTests(KPIDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_kpi(1, '2*ATTR', '123', '124')
+        self.add_kpi(2, 'ATTR+1', '124')
+        self.registry = KPIRegistry(self.db_path, refresh_interval=0)
+        self.addCleanup(self.registry.close)
+
+    def test_serves_every_kpi_of_an_asset(self):
+        self.assertEqual(self.registry.get_equations(['123', '124', '999']),
+                         {'123': [(1, '2*ATTR')], '124': [(1, '2*ATTR'), (2, 'ATTR+1')]})
+        self.assertEqual(self.registry.get_equation('124'), '2*ATTR')
+        self.assertIsNone(self.registry.get_equation('999'))
+        self.assertEqual(RegistryEquationReader(self.registry, '124').get_equations(), [(1, '2*ATTR'), (2, 'ATTR+1')])
+
+    def test_reloads_only_after_a_commit(self):
+        self.assertTrue(self.registry.refresh())
+        self.assertFalse(self.registry.refresh())
+        self.execute("UPDATE kpi_monitor_kpi SET expression = 'ATTR*3' WHERE id = 1")
+        self.assertTrue(self.registry.refresh())
+        self.assertEqual(self.registry.get_equation('123'), 'ATTR*3')
+
+    def test_refresh_interval_limits_checks(self):
+        registry = KPIRegistry(self.db_path, refresh_interval=3600)
+        self.addCleanup(registry.close)
+        self.assertEqual(registry.get_equation('123'), '2*ATTR')
+        self.execute("UPDATE kpi_monitor_kpi SET expression = 'ATTR*3' WHERE id = 1")
+        self.assertEqual(registry.get_equation('123'), '2*ATTR')
+        self.assertTrue(registry.refresh(force=True))
+        self.assertEqual(registry.get_equation('123'), 'ATTR*3')
+
+
+class BulkEquationReaderTests(KPIDatabaseTestCase):
+    def test_resolves_a_batch_across_chunks(self):
+        self.add_kpi(1, '2*ATTR', *[str(index) for index in range(7)])
+        self.add_kpi(2, 'ATTR+1', '3')
+        equations = BulkEquationReader(self.db_path, chunk_size=2).get_equations(['3', '0', '3', '6', '999'])
+        self.assertEqual(equations, {'0': [(1, '2*ATTR')], '3': [(1, '2*ATTR'), (2, 'ATTR+1')], '6': [(1, '2*ATTR')]})
+        self.assertEqual(EquationReader('3', self.db_path).get_equations(), [(1, '2*ATTR'), (2, 'ATTR+1')])
+
+
+class SQLiteConnectionProviderTests(KPIDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_kpi(1, '2*ATTR', '123')
+        self.provider = SQLiteConnectionProvider(self.db_path)
+        self.addCleanup(self.provider.close)
+
+    def test_one_read_only_connection_per_thread(self):
+        connection = self.provider.connection()
+        self.assertIs(self.provider.connection(), connection)
+        with self.assertRaises(sqlite3.OperationalError):
+            connection.execute("DELETE FROM kpi_monitor_kpi")
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.provider.connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], connection)
+        self.provider.close()
+        self.assertEqual(self.provider.connections, [])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+
+    def test_readers_share_the_provider(self):
+        self.assertEqual(self.provider.enable_wal(), 'wal')
+        self.assertEqual(EquationReader('123', self.db_path, self.provider).get_equation(), '2*ATTR')
+        self.assertIsNone(EquationReader('999', self.db_path, self.provider).get_equation())
+        self.assertEqual(len(self.provider.connections), 1)
+        registry = KPIRegistry(self.db_path, refresh_interval=0, connection_provider=self.provider)
+        self.assertEqual(registry.get_equation('123'), '2*ATTR')
+        self.execute("UPDATE kpi_monitor_kpi SET expression = 'ATTR*3' WHERE id = 1")
+        self.assertEqual(registry.get_equation('123'), 'ATTR*3')
+        self.assertEqual(len(self.provider.connections), 2)
+
+    def test_missing_database(self):
+        provider = SQLiteConnectionProvider(self.db_path + '.missing')
+        with self.assertRaises(FileNotFoundError):
+            provider.connection()
+
+
+class ConfigReaderTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.config_file = os.path.join(directory.name, 'eq.yml')
+        self.write_equation('2*ATTR')
+
+    def write_equation(self, equation):
+        with open(self.config_file, 'w') as file:
+            file.write(f"equation: '{equation}'\n")
+
+    def test_parses_the_file_only_when_it_changes(self):
+        reader = FileConfigReader(self.config_file)
+        config = reader.read_config()
+        self.assertEqual(config, {'equation': '2*ATTR'})
+        self.assertIs(reader.read_config(), config)
+        self.write_equation('ATTR + 10')
+        self.assertEqual(reader.read_config(), {'equation': 'ATTR + 10'})
+
+    def test_keeps_the_last_good_equation(self):
+        reader = EquationConfigReader(FileConfigReader(self.config_file), ExpressionCache())
+        equation, compiled = reader.current()
+        self.assertEqual(compiled.evaluate({'ATTR': 4}), 8)
+        self.write_equation('2 +* ATTR *')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(reader.current(), (equation, compiled))
+        os.remove(self.config_file)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(reader.current(), (equation, compiled))
+        self.write_equation('ATTR + 10')
+        self.assertEqual(reader.get_compiled().evaluate({'ATTR': 4}), 14)
+
+    def test_watcher_swaps_in_changes(self):
+        reader = EquationConfigReader(FileConfigReader(self.config_file))
+        watcher = ConfigWatcher(reader, interval=0.01)
+        watcher.start()
+        self.addCleanup(watcher.stop)
+        self.assertEqual(reader.get_equation(), '2*ATTR')
+        self.write_equation('ATTR + 10')
+        deadline = time.monotonic() + 5
+        while reader.get_equation() != 'ATTR + 10' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(reader.get_equation(), 'ATTR + 10')
+        watcher.stop()
+        self.assertFalse(reader.watched)
+
+
+class KPIChangeFeedTests(KPIDatabaseTestCase):
+    schema = SCHEMA + """
+        CREATE TABLE kpi_monitor_kpichange (
+            id INTEGER PRIMARY KEY, model_name TEXT NOT NULL, object_id INTEGER NOT NULL, action TEXT NOT NULL,
+            asset_id TEXT, kpi_id INTEGER, created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.add_kpi(1, '2*ATTR', '123', '124')
+        self.add_kpi(2, 'ATTR+1', '124')
+        self.changes = []
+        self.registry = KPIRegistry(self.db_path, refresh_interval=0, change_feed=KPIChangeFeed(max_changes=3),
+                                    on_change=lambda asset_ids, stale: self.changes.append((asset_ids, stale)))
+        self.addCleanup(self.registry.close)
+        self.registry.refresh()
+        self.loads = 0
+        load = self.registry.load
+
+        def counting_load():
+            self.loads += 1
+            load()
+        self.registry.load = counting_load
+
+    def log(self, model_name, object_id, action, asset_id=None, kpi_id=None):
+        self.execute("INSERT INTO kpi_monitor_kpichange (model_name, object_id, action, asset_id, kpi_id) "
+                     "VALUES (?, ?, ?, ?, ?)", (model_name, object_id, action, asset_id, kpi_id))
+
+    def test_reloads_only_the_assets_in_the_log(self):
+        self.execute("INSERT INTO kpi_monitor_assetkpi (id, asset_id, kpi_id) VALUES (10, '125', 2)")
+        self.log('assetkpi', 10, 'save', asset_id='125', kpi_id=2)
+        self.execute("DELETE FROM kpi_monitor_assetkpi WHERE asset_id = '124' AND kpi_id = 2")
+        self.log('assetkpi', 3, 'delete', asset_id='124', kpi_id=2)
+        self.assertTrue(self.registry.refresh())
+        self.assertEqual(self.loads, 0)
+        self.assertEqual(self.registry.get_equations(['123', '124', '125']),
+                         {'123': [(1, '2*ATTR')], '124': [(1, '2*ATTR')], '125': [(2, 'ATTR+1')]})
+        self.assertEqual(self.changes, [({'124', '125'}, set())])
+
+    def test_kpi_edit_reaches_every_linked_asset(self):
+        self.execute("UPDATE kpi_monitor_kpi SET expression = 'ATTR*3' WHERE id = 1")
+        self.log('kpi', 1, 'save', kpi_id=1)
+        self.assertTrue(self.registry.refresh())
+        self.assertEqual(self.loads, 0)
+        self.assertEqual(self.registry.get_equation('123'), 'ATTR*3')
+        self.assertEqual(self.changes, [({'123', '124'}, {'2*ATTR'})])
+        self.assertEqual(self.registry.change_feed.poll(self.registry.connection), (set(), 1))
+
+    def test_falls_back_to_a_full_load(self):
+        for _ in range(4):
+            self.log('kpi', 1, 'save', kpi_id=1)
+        self.assertTrue(self.registry.refresh())
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.registry.change_feed.poll(self.registry.connection), (set(), 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
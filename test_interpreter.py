@@ -0,0 +1,361 @@
+import contextlib
+import math
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from equation_reader import (CompiledExpressionStore, EquationProcessor, EquationReaderInterface, VariableBinder,
+                             coerce_value)
+from interpreter import (Parser, IterativeParser, RegexLexer, Interpreter, Compiler, Program, ExpressionDAG,
+                         ExpressionCache, Optimizer, BinOp, Num, Var, DEFAULT_BUDGET, EvaluationBudget,
+                         BudgetExceededError, FORMAT_VERSION, evaluate_batch, dumps, loads, token_map)
+
+
+def parse(expression):
+    return Parser(RegexLexer(expression, token_map)).parse()
+
+
+# (expression, record) pairs every backend must agree on; records hold text as read from the input feed
+CASES = [
+    ('(ATTR * 9/5) + 32', {'attribute_id': '12'}),
+    ('2*ATTR-3', {'attribute_id': '54'}),
+    ('(ATTR - 32) * 5 / 9 + ATTR ^ 2 - (ATTR * 3 + 7) / 2', {'attribute_id': '21'}),
+    ('2^3^2 + x', {'x': '1'}),
+    ('x / y', {'x': '7', 'y': '2'}),
+    ('x * 1.5 - 0.25', {'x': '3'}),
+    ('x ^ (0 - 1)', {'x': '4'}),
+    ('x + 0 + 1 * y', {'x': '5', 'y': '6'}),
+    ('REGEX(value, "^[A-E]$")', {'value': 'E'}),
+    ('REGEX(value, "^[A-E]$")', {'value': 'F'}),
+    # REGEX sees the text of numeric fields, not their conversion
+    ('REGEX(value, "^007$")', {'value': '007'}),
+    ('REGEX(value, "^1e3$")', {'value': '1e3'}),
+    ('REGEX(value, "^1_000$")', {'value': '1_000'}),
+    ('REGEX(value, "^NaN$")', {'value': 'NaN'}),
+    ('REGEX(value, "^42$")', {'value': '42'}),
+    # Integer results past int64 stay exact
+    ('x^40', {'x': '10'}),
+    ('x*y', {'x': str(2 ** 40), 'y': str(2 ** 40)}),
+    ('2^70+x', {'x': '1'}),
+    ('9223372036854775807 + x', {'x': '1'}),
+]
+
+
+def same(first, second):
+    if isinstance(first, float) and isinstance(second, float):
+        return math.isclose(first, second, rel_tol=1e-12) or (math.isnan(first) and math.isnan(second))
+    return first == second and type(first) is type(second)
+
+
+class BackendEquivalenceTests(unittest.TestCase):
+    """Interpreter, Compiler, Program, ExpressionDAG and evaluate_batch give the same results"""
+
+    def results(self, expression, record):
+        tree = parse(expression)
+        bindings = VariableBinder().bind(record)
+        columns = {name: [value] for name, value in record.items()}
+        optimized = Optimizer().optimize(parse(expression))
+        dag = ExpressionDAG(DEFAULT_BUDGET)
+        dag.add('kpi', tree)
+        return {
+            'Interpreter': Interpreter(budget=DEFAULT_BUDGET).evaluate(tree, bindings),
+            'Compiler': Compiler(DEFAULT_BUDGET).compile(tree)(bindings),
+            'Program': Program.from_tree(tree, DEFAULT_BUDGET).run(bindings),
+            'ExpressionDAG': dag.evaluate(bindings)['kpi'],
+            'ExpressionDAG slots': dag.evaluate_slots(bindings)['kpi'],
+            'evaluate_batch': evaluate_batch(tree, VariableBinder().bind_columns(columns)).tolist()[0],
+            'optimized': Interpreter().evaluate(optimized, bindings),
+            'loads(dumps())': Interpreter().evaluate(loads(dumps(tree)), bindings),
+        }
+
+    def test_backends_agree(self):
+        for expression, record in CASES:
+            results = self.results(expression, record)
+            expected = results['Interpreter']
+            for backend, result in results.items():
+                with self.subTest(expression=expression, record=record, backend=backend):
+                    self.assertTrue(same(result, expected), f"{result!r} != {expected!r}")
+
+    def test_exact_large_integers(self):
+        self.assertEqual(evaluate_batch(parse('x^40'), {'x': ['10', '2']}).tolist(), [10 ** 40, 2 ** 40])
+        self.assertEqual(evaluate_batch(parse('2^70+x'), {'x': ['1']}).tolist(), [2 ** 70 + 1])
+
+    def test_budget_applies_to_every_backend(self):
+        tree = parse('x^5000')
+        bindings = {'x': 99999999999}
+        dag = ExpressionDAG(DEFAULT_BUDGET)
+        dag.add('kpi', tree)
+        for evaluate in (lambda: Interpreter(budget=DEFAULT_BUDGET).evaluate(tree, bindings),
+                         lambda: Compiler(DEFAULT_BUDGET).compile(tree)(bindings),
+                         lambda: Program.from_tree(tree, DEFAULT_BUDGET).run(bindings),
+                         lambda: evaluate_batch(tree, {'x': ['99999999999']})):
+            with self.assertRaises(BudgetExceededError):
+                evaluate()
+        self.assertIsInstance(dag.evaluate(bindings)['kpi'], BudgetExceededError)
+
+    def test_batch_division_by_zero(self):
+        """Rows raise, a batch yields inf for the failing rows only"""
+        tree = parse('x / y')
+        with self.assertRaises(ZeroDivisionError):
+            Program.from_tree(tree).run({'x': 1, 'y': 0})
+        self.assertEqual(evaluate_batch(tree, {'x': ['1', '4'], 'y': ['0', '2']}).tolist(), [math.inf, 2.0])
+
+    def test_undefined_variable(self):
+        tree = parse('x + 1')
+        for evaluate in (lambda: Interpreter().evaluate(tree, {}),
+                         lambda: Program.from_tree(tree).run({}),
+                         lambda: evaluate_batch(tree, {'y': [1]})):
+            with self.assertRaisesRegex(Exception, "Undefined variable 'x'"):
+                evaluate()
+
+    def test_dag_keeps_every_name(self):
+        cache = ExpressionCache()
+        results = cache.get_group([(1, '2*ATTR'), (2, '2*ATTR'), (3, 'ATTR+1')]).evaluate({'ATTR': 5})
+        self.assertEqual(results, {1: 10, 2: 10, 3: 6})
+
+    def test_group_keeps_each_kpi_budget(self):
+        cache = ExpressionCache()
+        strict = EvaluationBudget(max_exponent=10)
+        group = cache.get_group([(1, 'ATTR^20'), (2, 'ATTR^20', strict), (3, 'ATTR+1', strict)])
+        results = group.evaluate({'ATTR': 2})
+        self.assertEqual(results[1], 2 ** 20)
+        self.assertIsInstance(results[2], BudgetExceededError)
+        self.assertEqual(results[3], 3)
+
+    def test_cache_compiles_per_budget(self):
+        cache = ExpressionCache()
+        strict = EvaluationBudget(max_exponent=10)
+        self.assertEqual(cache.get('ATTR^20').evaluate({'ATTR': 2}), 2 ** 20)
+        with self.assertRaises(BudgetExceededError):
+            cache.get('ATTR^20', strict).evaluate({'ATTR': 2})
+        self.assertIs(cache.get('ATTR^20', EvaluationBudget(max_exponent=10)), cache.get('ATTR^20', strict))
+        self.assertIs(cache.get('ATTR^20', DEFAULT_BUDGET), cache.get('ATTR^20'))
+        cache.evict('ATTR^20')
+        self.assertEqual(len(cache), 0)
+
+    def test_interpreter_checks_nodes_once_per_tree(self):
+        checked = []
+
+        class CountingBudget(EvaluationBudget):
+            def check_nodes(self, tree):
+                checked.append(tree)
+                super().check_nodes(tree)
+
+        interpreter = Interpreter(budget=CountingBudget())
+        first, second = parse('x + 1'), parse('x * 2')
+        for x in range(3):
+            interpreter.evaluate(first, {'x': x})
+        interpreter.evaluate(second, {'x': 1})
+        self.assertEqual(checked, [first, second])
+        with self.assertRaises(BudgetExceededError):
+            Interpreter(budget=EvaluationBudget(max_nodes=2)).evaluate(first, {'x': 1})
+
+
+class BatchEvaluationTests(unittest.TestCase):
+    def test_numpy_columns(self):
+        result = evaluate_batch(parse('x * 2 + y'), {'x': np.array([1, 2, 3]), 'y': np.array([0.5, 0.5, 0.5])})
+        self.assertEqual(result.tolist(), [2.5, 4.5, 6.5])
+        self.assertEqual(evaluate_batch(parse('3'), {'x': [1, 2]}).tolist(), [3, 3])
+
+    def test_text_columns_match_row_evaluation(self):
+        records = [{'attribute_id': '1', 'value': 'E'}, {'attribute_id': '2.5', 'value': 'F'},
+                   {'attribute_id': '007', 'value': 'A'}]
+        columns = {name: tuple(record[name] for record in records) for name in records[0]}
+        compiled = ExpressionCache().get('(ATTR * 9/5) + 32 + REGEX(value, "^[A-E]$")')
+        binder = VariableBinder()
+        self.assertEqual(compiled.evaluate_batch(binder.bind_columns(columns)).tolist(),
+                         [compiled.evaluate(binder.bind(record)) for record in records])
+
+
+class ExpressionDAGTests(unittest.TestCase):
+    def test_shares_common_subexpressions(self):
+        dag = ExpressionDAG()
+        dag.add(1, parse('(ATTR * 9/5) + 32'))
+        size = len(dag)
+        dag.add(2, parse('ATTR * 9/5 - 1'))
+        # Only '1' and the subtraction are new
+        self.assertEqual(len(dag) - size, 2)
+        self.assertEqual(dag.evaluate({'ATTR': 10}), {1: 50.0, 2: 17.0})
+
+    def test_failing_kpi_does_not_hide_the_others(self):
+        cache = ExpressionCache()
+        group = cache.get_group([(1, 'x / y'), (2, 'x + 1'), (3, 'z * 2')])
+        results = group.evaluate({'x': 1, 'y': 0})
+        self.assertIsInstance(results[1], ZeroDivisionError)
+        self.assertEqual(results[2], 2)
+        self.assertEqual(str(results[3]), "Undefined variable 'z'")
+        self.assertIs(cache.get_group([(1, 'x / y'), (2, 'x + 1'), (3, 'z * 2')]), group)
+
+
+class FixedEquation(EquationReaderInterface):
+    def get_equation(self):
+        return 'ATTR * 2 + offset_1'
+
+
+class VariableTests(unittest.TestCase):
+    def test_one_tree_serves_every_record(self):
+        processor = EquationProcessor(FixedEquation(), VariableBinder())
+        cache = ExpressionCache()
+        results = []
+        for record in ({'attribute_id': '1', 'offset_1': '10'}, {'attribute_id': '2.5', 'offset_1': '0'}):
+            (_, equation), = processor.process_equations(record)
+            self.assertEqual(equation, 'ATTR * 2 + offset_1')
+            results.append(cache.get(equation).evaluate(processor.bind(record)))
+        self.assertEqual(results, [12, 5.0])
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_bindings_keep_the_text_of_numbers(self):
+        for text, number in (('12', 12), ('007', 7), ('1.50', 1.5), ('1e3', 1000.0)):
+            with self.subTest(text=text):
+                value = coerce_value(text)
+                self.assertEqual(value, number)
+                self.assertIs(type(value + 0), type(number))
+                self.assertEqual(str(value), text)
+        self.assertEqual(coerce_value('E'), 'E')
+        self.assertEqual(VariableBinder().bind({'attribute_id': '3', 'value': 'E'}),
+                         {'attribute_id': 3, 'value': 'E', 'ATTR': 3})
+
+
+class ParserTests(unittest.TestCase):
+    """The recursive Parser and the IterativeParser accept the same language"""
+    VALID = [expression for expression, _ in CASES] + [
+        'REGEX(x, "a") + 1',
+        'REGEX(x, "a") * 2 ^ REGEX(y, "b")',
+        '(((ATTR)))',
+        '1.5 * 2',
+    ]
+    INVALID = ['1.2.3', '2 x', 'ATTR 5', 'REGEX(x, "a") REGEX(y, "b")', '1 +', '(1', '1)', '()', '', '* 2']
+
+    def parse_both(self, expression):
+        return [parser(RegexLexer(expression, token_map)).parse() for parser in (Parser, IterativeParser)]
+
+    def test_parsers_agree(self):
+        for expression in self.VALID:
+            with self.subTest(expression=expression):
+                recursive, iterative = self.parse_both(expression)
+                self.assertEqual(dumps(recursive), dumps(iterative))
+
+    def test_both_reject_invalid_syntax(self):
+        for expression in self.INVALID:
+            for parser in (Parser, IterativeParser):
+                with self.subTest(expression=expression, parser=parser.__name__):
+                    with self.assertRaises(Exception):
+                        parser(RegexLexer(expression, token_map)).parse()
+
+    def test_deep_nesting_falls_back_to_the_stack_machine(self):
+        expression = '(' * 3000 + 'ATTR' + '+1)' * 3000
+        compiled = ExpressionCache(budget=None).get(expression)
+        self.assertIsNotNone(compiled.program)
+        self.assertEqual(compiled.evaluate({'ATTR': 2}), 3002)
+
+
+    def test_stack_machine_runs_deep_trees(self):
+        expression = '(' * 4000 + 'x' + '-1)' * 4000
+        tree = IterativeParser(RegexLexer(expression, token_map)).parse()
+        program = Program.from_tree(tree, DEFAULT_BUDGET)
+        self.assertEqual(program.run({'x': 4000}), 0)
+        chain = ' - '.join(['x'] * 4000)
+        self.assertEqual(Program.from_tree(IterativeParser(RegexLexer(chain, token_map)).parse()).run({'x': 1}), -3998)
+
+
+class OptimizerTests(unittest.TestCase):
+    def test_folds_constants(self):
+        optimizer = Optimizer()
+        tree = optimizer.optimize(parse('(2 + 3) * 4'))
+        self.assertIsInstance(tree, Num)
+        self.assertEqual(tree.value, 20)
+        self.assertEqual(optimizer.removed, 4)
+
+    def test_removes_identities(self):
+        for expression in ('x + 0', '0 + x', 'x - 0', 'x * 1', '1 * x', 'x ^ 1'):
+            with self.subTest(expression=expression):
+                tree = Optimizer().optimize(parse(expression))
+                self.assertIsInstance(tree, Var)
+
+    def test_folds_regex_over_literal(self):
+        tree = Optimizer().optimize(parse('REGEX("E", "^[A-E]$")'))
+        self.assertIsInstance(tree, Num)
+        self.assertIs(tree.value, True)
+
+    def test_keeps_identities_on_regex(self):
+        tree = Optimizer().optimize(parse('(REGEX(value, "E")) + 0'))
+        self.assertIsInstance(tree, BinOp)
+
+    def test_does_not_fold_huge_results(self):
+        self.assertIsInstance(Optimizer().optimize(parse('9^9^9')), BinOp)
+
+    def test_keeps_result_types(self):
+        for expression in ('x * 1.0', 'x + 0.0', '1.0 * x'):
+            with self.subTest(expression=expression):
+                tree = Optimizer().optimize(parse(expression))
+                self.assertIs(type(Interpreter().evaluate(tree, {'x': 2})), float)
+        tree = Optimizer().optimize(parse('4 / 2'))
+        self.assertEqual(tree.value, 2.0)
+        self.assertIs(type(tree.value), float)
+
+    def test_cache_evaluates_the_optimized_tree(self):
+        compiled = ExpressionCache().get('(2 + 3) * ATTR + 0')
+        self.assertEqual(compiled.removed_nodes, 4)
+        self.assertEqual(dumps(compiled.tree), dumps(parse('5 * ATTR')))
+        self.assertEqual(compiled.evaluate({'ATTR': 2}), 10)
+
+    def test_leaves_errors_to_evaluation(self):
+        tree = Optimizer().optimize(parse('1 / 0'))
+        self.assertIsInstance(tree, BinOp)
+        with self.assertRaises(ZeroDivisionError):
+            Interpreter().evaluate(tree)
+
+
+class SerializationTests(unittest.TestCase):
+    def test_round_trip(self):
+        for expression, _ in CASES:
+            with self.subTest(expression=expression):
+                data = dumps(parse(expression))
+                self.assertEqual(dumps(loads(data)), data)
+
+    def test_keeps_constant_types(self):
+        tree = loads(dumps(parse('1 + 1.0 + x')))
+        self.assertEqual(Interpreter().evaluate(tree, {'x': 1}), 3.0)
+        self.assertIs(type(tree.left.left.value), int)
+        self.assertIs(type(tree.left.right.value), float)
+
+    def test_rejects_other_formats(self):
+        data = dumps(parse('x + 1'))
+        with self.assertRaises(Exception):
+            loads(b'XXXX' + data[4:])
+        with self.assertRaises(Exception):
+            loads(b'')
+        with self.assertRaises(Exception):
+            loads(data[:4] + bytes([data[4] + 1]) + data[5:])
+
+    def test_preloaded_expressions_skip_the_parser(self):
+        source = ExpressionCache()
+        source.get('(ATTR * 9/5) + 32')
+        cache = ExpressionCache(lexer_class=None)  # Parsing would fail
+        cache.preload(source.export())
+        self.assertEqual(cache.get('(ATTR * 9/5) + 32').evaluate({'ATTR': 10}), 50.0)
+
+    def test_store_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = CompiledExpressionStore(os.path.join(directory, 'compiled.db'))
+            source = ExpressionCache()
+            for expression in ('2*ATTR', 'REGEX(value, "^[A-E]$")'):
+                source.get(expression)
+            self.assertTrue(store.save(source.export()))
+            # Written by an older release, must not be loaded
+            with contextlib.closing(store.connect()) as connection:
+                with connection:
+                    connection.execute("INSERT INTO compiled_expressions VALUES ('old', ?, ?)",
+                                       (FORMAT_VERSION - 1, b''))
+            serialized = store.load()
+        self.assertEqual(set(serialized), {'2*ATTR', 'REGEX(value, "^[A-E]$")'})
+        cache = ExpressionCache(lexer_class=None)
+        self.assertEqual(cache.preload(serialized), 2)
+        self.assertEqual(cache.get('2*ATTR').evaluate({'ATTR': 4}), 8)
+        self.assertIs(cache.get('REGEX(value, "^[A-E]$")').evaluate({'value': 'F'}), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from message_producer import (ITimestampGenerator, JsonMessageFormatter, MessageProducer, OutputMessage,
+                              SQLiteMessageStorage)
+
+
+class FixedTimestamp(ITimestampGenerator):
+    def generate(self):
+        return '2024-11-24T11:44:18Z[UTC]'
+
+
+class SQLiteMessageStorageTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, 'messages', 'output_messages.db')
+        # Every commit prints a line
+        stdout = contextlib.redirect_stdout(io.StringIO())
+        stdout.__enter__()
+        self.addCleanup(stdout.__exit__, None, None, None)
+
+    def connect(self, batch_size, flush_interval=3600):
+        storage = SQLiteMessageStorage(self.db_path, batch_size=batch_size, flush_interval=flush_interval)
+        storage.connect()
+        self.addCleanup(storage.disconnect)
+        return storage
+
+    def stored(self):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            return connection.execute("SELECT asset_id, value, kpi_id FROM output_messages ORDER BY id").fetchall()
+
+    def message(self, asset_id, kpi_id=None):
+        return OutputMessage(asset_id, '1', '2024-11-24T11:44:18Z[UTC]', '42', kpi_id)
+
+    def test_writes_in_wal_mode(self):
+        storage = self.connect(batch_size=1)
+        self.assertEqual(storage.connection.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertTrue(storage.store_message(self.message('a', 7)))
+        self.assertEqual(self.stored(), [('a', '42', 7)])
+
+    def test_commits_once_batch_size_messages_wait(self):
+        storage = self.connect(batch_size=3)
+        for asset_id in 'ab':
+            self.assertTrue(storage.store_message(self.message(asset_id)))
+        self.assertEqual(self.stored(), [])
+        self.assertTrue(storage.store_message(self.message('c')))
+        self.assertEqual([row[0] for row in self.stored()], ['a', 'b', 'c'])
+        self.assertTrue(storage.store_rows([('d', '1', '2024-11-24T11:44:18Z[UTC]', '5', 2)]))
+        storage.disconnect()
+        self.assertEqual(self.stored()[-1], ('d', '5', 2))
+
+    def test_flush_if_due(self):
+        storage = self.connect(batch_size=100, flush_interval=0.05)
+        storage.store_message(self.message('a'))
+        self.assertTrue(storage.flush_if_due())
+        self.assertEqual(self.stored(), [])
+        time.sleep(0.06)
+        self.assertTrue(storage.flush_if_due())
+        self.assertEqual(len(self.stored()), 1)
+
+    def test_failed_batch_is_dropped_as_a_whole(self):
+        storage = self.connect(batch_size=3)
+        producer = MessageProducer(JsonMessageFormatter(), storage, FixedTimestamp())
+        producer.produce_message('a', '1', '42')
+        producer.produce_message(None, '1', '42')
+        with self.assertRaisesRegex(Exception, 'Failed to store batch of 3 messages'):
+            producer.produce_message('c', '1', '42')
+        self.assertEqual(self.stored(), [])
+        self.assertEqual(storage.pending, [])
+        self.assertEqual(producer.produce_batch(['d', 'e', 'f'], ['1', '2', '3'], [1, 2, 3], kpi_id=4), 3)
+        self.assertEqual(self.stored(), [('d', '1', 4), ('e', '2', 4), ('f', '3', 4)])
+
+    def test_adds_kpi_id_to_an_old_table(self):
+        os.makedirs(os.path.dirname(self.db_path))
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            connection.execute("CREATE TABLE output_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, asset_id TEXT "
+                               "NOT NULL, attribute_id TEXT NOT NULL, timestamp TEXT NOT NULL, value TEXT NOT NULL)")
+        storage = self.connect(batch_size=1)
+        storage.store_message(self.message('a', 7))
+        self.assertEqual(self.stored(), [('a', '42', 7)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+import asyncio
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from data_ingestor import CSVBatchReader, DataFilter, DataIngestor, DataReader
+from equation_reader import EquationProcessor, EquationReaderInterface, VariableBinder
+from interpreter import ExpressionCache
+from message_producer import (IMessageStorage, ITimestampGenerator, JsonMessageFormatter, MessageProducer,
+                              SQLiteMessageStorage)
+from pipeline import Pipeline, store_batches
+
+
+def make_records(count):
+    return [{'asset_id': str(index), 'attribute_id': str(index), 'timestamp': '2024-11-24T11:44:18Z[UTC]',
+             'value': 'E'} for index in range(count)]
+
+
+class FollowingReader(DataReader):
+    """Hands out its records, then waits for more until stop(), like a following CSVDataReader"""
+    def __init__(self, records):
+        self.records = records
+        self.exhausted = threading.Event()
+        self.stopped = threading.Event()
+
+    def read_records(self):
+        yield from self.records
+        self.exhausted.set()
+        self.stopped.wait()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class ListReader(DataReader):
+    def __init__(self, records):
+        self.records = records
+
+    def read_records(self):
+        yield from self.records
+
+
+class SlowStorage(IMessageStorage):
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.messages = []
+        self.connected = False
+
+    def store_message(self, message):
+        time.sleep(self.delay)
+        self.messages.append(message)
+        return True
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+
+class FixedTimestamp(ITimestampGenerator):
+    def generate(self):
+        return '2024-11-24T11:44:18Z[UTC]'
+
+
+class FixedEquation(EquationReaderInterface):
+    def get_equation(self):
+        return '2*ATTR'
+
+
+expression_cache = ExpressionCache()
+
+
+def evaluate(equations, bindings):
+    return {kpi_id: expression_cache.get(equation).evaluate(bindings) for kpi_id, equation in equations}
+
+
+def create_equation_processor(asset_id):
+    return EquationProcessor(FixedEquation(), VariableBinder())
+
+
+class PipelineTests(unittest.TestCase):
+    def make_pipeline(self, reader, storage, maxsize=1000):
+        storage.connect()
+        producer = MessageProducer(JsonMessageFormatter(), storage, FixedTimestamp())
+        data_filter = DataFilter()
+        pipeline = Pipeline(DataIngestor(reader, data_filter, interval=None), create_equation_processor,
+                            evaluate, lambda: producer, maxsize=maxsize)
+        return pipeline, data_filter
+
+    def test_stores_every_record(self):
+        storage = SlowStorage()
+        pipeline, _ = self.make_pipeline(ListReader(make_records(20)), storage, maxsize=2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(pipeline.run())
+        self.assertEqual(sorted(int(message.value) for message in storage.messages),
+                         [2 * index for index in range(20)])
+        self.assertEqual({message.kpi_id for message in storage.messages}, {None})
+
+    def test_cancel_drains_queued_records(self):
+        """Everything the filter admitted before Ctrl-C is stored, and the reader has exited"""
+        reader = FollowingReader(make_records(50))
+        storage = SlowStorage(delay=0.005)
+        pipeline, data_filter = self.make_pipeline(reader, storage)
+
+        async def interrupt():
+            task = asyncio.create_task(pipeline.run())
+            await asyncio.get_running_loop().run_in_executor(None, reader.exhausted.wait)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(interrupt())
+        self.assertEqual(len(storage.messages), len(data_filter.slots))
+        self.assertEqual(len(storage.messages), 50)
+        self.assertFalse(any(thread.is_alive() for thread in pipeline.reader_executor._threads))
+        self.assertFalse(storage.connected)
+
+
+class AssetEquations(EquationReaderInterface):
+    """Assets 'a' and 'b' share KPI 1, 'b' also has KPI 2, 'c' has none"""
+    equations = {'a': [(1, '2*ATTR')], 'b': [(1, '2*ATTR'), (2, 'ATTR+1')], 'c': []}
+
+    def __init__(self, asset_id):
+        self.asset_id = asset_id
+
+    def get_equation(self):
+        return None
+
+    def get_equations(self):
+        return self.equations[self.asset_id]
+
+
+class CountingStorage(SQLiteMessageStorage):
+    def __init__(self, db_path, batch_size):
+        super().__init__(db_path, batch_size=batch_size, flush_interval=3600)
+        self.commits = []
+
+    def flush(self):
+        size = len(self.pending)
+        stored = super().flush()
+        if size:
+            self.commits.append(size)
+        return stored
+
+
+class StoreBatchesTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.csv_path = os.path.join(directory.name, 'data.csv')
+        with open(self.csv_path, 'w') as file:
+            file.write('asset_id,attribute_id,timestamp,value\n')
+            for index, asset_id in enumerate('abcab'):
+                file.write(f'{asset_id},{index},2024-11-24T11:44:{10 + index}Z[UTC],E\n')
+        self.db_path = os.path.join(directory.name, 'messages.db')
+        self.lookups = []
+
+    def create_equation_processor(self, asset_id):
+        self.lookups.append(asset_id)
+        return EquationProcessor(AssetEquations(asset_id), VariableBinder())
+
+    def run_batches(self, batch_size, chunk_size=10000):
+        storage = CountingStorage(self.db_path, batch_size)
+        storage.connect()
+        producer = MessageProducer(JsonMessageFormatter(), storage, FixedTimestamp())
+        ingestor = DataIngestor(CSVBatchReader(self.csv_path, chunk_size=chunk_size), DataFilter(), interval=None)
+        with contextlib.redirect_stdout(io.StringIO()):
+            stored = store_batches(ingestor, self.create_equation_processor,
+                                   lambda expression, columns: expression_cache.get(expression).evaluate_batch(columns),
+                                   producer)
+        storage.disconnect()
+        return stored, storage.commits
+
+    def stored_rows(self):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as connection:
+            return sorted(connection.execute('SELECT asset_id, attribute_id, value, kpi_id FROM output_messages'))
+
+    def test_groups_rows_by_kpi_and_commits_once_per_batch(self):
+        stored, commits = self.run_batches(batch_size=256)
+        self.assertEqual(stored, 6)
+        self.assertEqual(commits, [6])
+        self.assertEqual(sorted(self.lookups), ['a', 'b', 'c'])
+        self.assertEqual(self.stored_rows(), [
+            ('a', '0', '0', 1), ('a', '3', '6', 1),
+            ('b', '1', '2', 1), ('b', '1', '2', 2), ('b', '4', '5', 2), ('b', '4', '8', 1),
+        ])
+
+    def test_commits_once_per_record_batch(self):
+        stored, commits = self.run_batches(batch_size=256, chunk_size=3)
+        self.assertEqual(stored, 6)
+        self.assertEqual(commits, [3, 3])
+
+    def test_commits_when_batch_size_fills_up(self):
+        stored, commits = self.run_batches(batch_size=2)
+        self.assertEqual(stored, 6)
+        self.assertEqual(commits, [4, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()